@@ -0,0 +1,115 @@
+#! /usr/bin/python2
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Micro-benchmark of exclusion rules matching (see pycompile's filter_files).
+
+Compares the linear scan over all rules with debpython.exclude.ExcludeMatcher
+using synthetic rule sets and file lists.
+"""
+
+import optparse
+import random
+import re
+import sys
+from os.path import abspath, dirname
+from time import time
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from debpython.exclude import ExcludeMatcher
+
+VERSIONS = (set([(2, 6)]), set([(2, 7)]), set([(2, 6), (2, 7)]))
+SITEDIR = '/usr/lib/python2.7/dist-packages'
+
+
+def synthetic_rules(count, rnd):
+    """Return `count` dir and re rules (half of each)."""
+    result = []
+    for i in xrange(count):
+        versions = rnd.choice(VERSIONS)
+        if i % 2:
+            dname = "%s/pkg%d/sub%d" % (SITEDIR, i, i % 7)
+            result.append(('dir', versions, dname, None))
+        else:
+            pattern = re.compile(r".*/pkg%d/(test|tests)_[a-z]+\.py$" % i)
+            result.append(('re', versions, '/', pattern))
+    return result
+
+
+def synthetic_files(count, packages, rnd):
+    return ["%s/pkg%d/sub%d/%s%d.py" % (SITEDIR, rnd.randrange(packages),
+                                         rnd.randrange(7),
+                                         rnd.choice(('mod', 'test_')), i)
+            for i in xrange(count)]
+
+
+def linear(files, e_patterns, compile_versions):
+    """Implementation used before ExcludeMatcher was introduced."""
+    for fn in files:
+        valid_versions = set(compile_versions)
+        for type_, vers, dname, pattern in e_patterns:
+            if type_ == 'dir' and fn.startswith(dname):
+                valid_versions = valid_versions - vers
+            elif type_ == 're' and pattern.match(fn):
+                valid_versions = valid_versions - vers
+            if not valid_versions:
+                break
+        yield fn, valid_versions
+
+
+def matcher(files, e_patterns, compile_versions):
+    compile_versions = frozenset(compile_versions)
+    matcher = ExcludeMatcher(e_patterns)
+    for fn in files:
+        yield fn, compile_versions - matcher.match(fn)
+
+
+def measure(func, files, rules, versions):
+    start = time()
+    result = list(func(files, rules, versions))
+    return time() - start, result
+
+
+def main():
+    parser = optparse.OptionParser('%prog [-f FILES] [-r RULES]...')
+    parser.add_option('-f', '--files', type='int', default=20000,
+                      help='number of file names to match')
+    parser.add_option('-r', '--rules', type='int', action='append',
+                      help='size of rule set (can be used multiple times)')
+    parser.add_option('-s', '--seed', type='int', default=0)
+    options, args = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    versions = set([(2, 6), (2, 7)])
+    print "%8s %10s %10s %8s" % ('rules', 'linear', 'matcher', 'speedup')
+    for count in options.rules or (10, 100, 1000):
+        rules = synthetic_rules(count, rnd)
+        files = synthetic_files(options.files, count, rnd)
+        linear_time, expected = measure(linear, files, rules, versions)
+        matcher_time, result = measure(matcher, files, rules, versions)
+        if [(fn, set(v)) for fn, v in result] != expected:
+            sys.stderr.write("results differ for %d rules\n" % count)
+            exit(1)
+        print "%8d %9.3fs %9.3fs %7.1fx" % (count, linear_time, matcher_time,
+                                            linear_time / matcher_time)
+
+if __name__ == '__main__':
+    main()
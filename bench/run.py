@@ -0,0 +1,199 @@
+#! /usr/bin/python2
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Benchmarks of debpython tools over synthetic site-packages trees.
+
+Examples:
+    bench/run.py --save before.json  # run benchmarks, save results
+    bench/run.py --compare before.json  # run and compare with saved results
+
+Everything runs offline in a temporary DESTDIR (see bench/synth.py).
+"""
+
+from __future__ import with_statement
+import imp
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+from os.path import abspath, dirname, exists, join
+from subprocess import Popen, PIPE
+from time import time
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, dirname(abspath(__file__)))
+
+import synth
+
+
+def measure(func, repeat, setup=None):
+    """Return min and median time of `repeat` func() calls."""
+    times = []
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+        start = time()
+        func()
+        times.append(time() - start)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2], 'runs': repeat}
+
+
+def tool(name, *args):
+    """Return function that runs given tool from the source tree."""
+    cmd = [sys.executable, join(ROOT, name)] + list(args)
+
+    def run():
+        process = Popen(cmd, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise Exception("%s failed: %s" % (' '.join(cmd), stderr))
+    return run
+
+
+def revision():
+    try:
+        process = Popen(['git', 'describe', '--always', '--dirty'],
+                        cwd=ROOT, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+    except OSError:
+        return None
+    return stdout.strip() or None
+
+
+def benchmarks(destdir, packages, options):
+    """Generate (name, function, setup function) tuples."""
+    from debpython import files as dpf
+    from debpython.namespace import add_namespace_files
+    from debpython.version import getver
+    pycompile = imp.load_source('pycompile', join(ROOT, 'pycompile'))
+
+    site = synth.sitedir(destdir, options.python)
+    all_files = list(dpf.from_directory(site, ('.py', '.so')))
+    versions = set([getver(options.python)])
+
+    yield ('from_directory',
+           lambda: list(dpf.from_directory(site, ('.py', '.so'))), None)
+    yield ('walk_files',
+           lambda: list(dpf.walk_files(site, ('.py', '.so'))), None)
+    yield ('filter_files',
+           lambda: list(pycompile.filter_files(
+               all_files, pycompile.get_exclude_patterns(site), versions)),
+           None)
+    yield ('add_namespace_files',
+           lambda: list(add_namespace_files(all_files, action=True)), None)
+
+    if not exists("/usr/bin/python%s" % options.python):
+        sys.stderr.write("/usr/bin/python%s not available, skipping "
+                         "pycompile benchmarks\n" % options.python)
+        return
+    compile_all = tool('pycompile', '-f', site)
+    yield 'pycompile (all files)', compile_all, None
+    yield 'pycompile (up to date)', tool('pycompile', site), compile_all
+    yield 'pyclean', tool('pyclean', site), compile_all
+    args = []
+    for package in sorted(packages):
+        args.extend(('-p', package))
+    yield 'pyclean -p (all packages)', tool('pyclean', *args), compile_all
+
+
+def compare(old, new):
+    print "%-28s %10s %10s %8s" % ('benchmark', 'old', 'new', 'change')
+    for name in sorted(new):
+        new_time = new[name]['min']
+        if name not in old:
+            print "%-28s %10s %9.4fs" % (name, '-', new_time)
+            continue
+        old_time = old[name]['min']
+        print "%-28s %9.4fs %9.4fs %+7.1f%%" % (
+            name, old_time, new_time,
+            (new_time - old_time) / old_time * 100 if old_time else 0)
+
+
+def main():
+    parser = optparse.OptionParser('%prog [options]')
+    parser.add_option('--packages', type='int', default=100)
+    parser.add_option('--modules', type='int', default=20,
+                      help='number of modules in each package')
+    parser.add_option('--depth', type='int', default=3,
+                      help='maximum depth of subpackages')
+    parser.add_option('--namespaces', type='int', default=10,
+                      help='number of shared namespace packages')
+    parser.add_option('--rules', type='int', default=10,
+                      help='number of packages with bcep rules')
+    parser.add_option('--python', default='2.7', metavar='X.Y',
+                      help='Python version of generated site directory')
+    parser.add_option('-n', '--repeat', type='int', default=5)
+    parser.add_option('--destdir', help='generate tree in given directory '
+                      '(and keep it), temporary directory is used by default')
+    parser.add_option('--save', metavar='FILE',
+                      help='save results to given JSON file')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare results with the ones saved in FILE')
+    options, args = parser.parse_args()
+
+    destdir = options.destdir or tempfile.mkdtemp(prefix='debpython-bench-')
+    destdir = abspath(destdir)
+    os.environ['DESTDIR'] = destdir
+    os.environ['DPKG_ADMINDIR'] = join(destdir, 'var/lib/dpkg')
+    os.environ.setdefault('DEBPYTHON_SUPPORTED', options.python)
+    os.environ.setdefault('DEBPYTHON_DEFAULT', options.python)
+
+    try:
+        start = time()
+        packages = synth.generate(destdir, options.packages, options.modules,
+                                  options.depth, options.namespaces,
+                                  options.rules, options.python)
+        print "generated %d files in %.2fs (%s)" % (
+            sum(len(i) for i in packages.itervalues()), time() - start,
+            destdir)
+
+        results = {}
+        for name, func, setup in benchmarks(destdir, packages, options):
+            results[name] = measure(func, options.repeat, setup)
+            print "%-28s %9.4fs (median %.4fs)" % (
+                name, results[name]['min'], results[name]['median'])
+    finally:
+        if not options.destdir:
+            shutil.rmtree(destdir)
+
+    if options.compare:
+        with open(options.compare) as fp:
+            old = json.load(fp)
+        print
+        print "compared with %s" % (old.get('revision') or options.compare)
+        compare(old['results'], results)
+    if options.save:
+        params = dict((i, getattr(options, i)) for i in (
+            'packages', 'modules', 'depth', 'namespaces', 'rules', 'python',
+            'repeat'))
+        with open(options.save, 'w') as fp:
+            json.dump({'revision': revision(), 'params': params,
+                       'results': results}, fp, indent=1,
+                      separators=(',', ': '), sort_keys=True)
+            fp.write('\n')
+
+if __name__ == '__main__':
+    main()
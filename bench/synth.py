@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Synthetic dist-packages trees for benchmarks.
+
+Everything is created in a fake DESTDIR: modules in
+DESTDIR/usr/lib/pythonX.Y/dist-packages, namespace declarations in
+DESTDIR/usr/share/python/ns/, exclusion rules in
+DESTDIR/usr/share/python/bcep/ and file lists in DESTDIR/var/lib/dpkg/info/
+(use it as DPKG_ADMINDIR).
+"""
+
+from __future__ import with_statement
+import os
+import random
+from os.path import dirname, exists, join
+
+MODULE = '''"""Synthetic module %(number)d."""
+
+import os
+
+
+class Class%(number)d(object):
+    """Dummy class."""
+
+    def __init__(self, value=%(number)d):
+        self.value = value
+
+%(functions)s'''
+
+FUNCTION = '''
+def function%d(arg, *args, **kwargs):
+    """Dummy function."""
+    result = [i * %d for i in range(arg) if i %% 3]
+    return os.path.join(*[str(i) for i in result]) if result else None
+'''
+
+
+def sitedir(destdir, version='2.7'):
+    return join(destdir, "usr/lib/python%s/dist-packages" % version)
+
+
+def _write(fpath, content=''):
+    dpath = dirname(fpath)
+    if not exists(dpath):
+        os.makedirs(dpath)
+    with open(fpath, 'w') as fp:
+        fp.write(content)
+
+
+def generate(destdir, packages=100, modules=20, depth=3, namespaces=10,
+             rules=10, version='2.7', seed=0):
+    """Create synthetic tree in destdir.
+
+    :param packages: number of Debian packages (one Python package each)
+    :param modules: number of modules in each package
+    :param depth: maximum depth of subpackages
+    :param namespaces: number of namespace packages shared by packages
+    :param rules: number of packages with exclusion rules (bcep)
+    :return: {Debian package name: list of files}
+    """
+    rnd = random.Random(seed)
+    site = sitedir(destdir, version)
+    infodir = join(destdir, 'var/lib/dpkg/info')
+    if not exists(infodir):
+        os.makedirs(infodir)
+    result = {}
+    for i in xrange(packages):
+        dist = "python-pkg%d" % i
+        if namespaces:
+            ns = "ns%d" % (i % namespaces)
+            _write(join(destdir, 'usr/share/python/ns', dist), ns + '\n')
+            root = join(site, ns, "pkg%d" % i)
+        else:
+            root = join(site, "pkg%d" % i)
+        files = [join(root, '__init__.py')]
+        for j in xrange(modules):
+            subdir = join(*["sub%d" % rnd.randrange(3)
+                            for k in xrange(rnd.randrange(depth + 1))] or [''])
+            files.append(join(root, subdir, "mod%d.py" % j))
+            if subdir:
+                files.append(join(root, subdir, '__init__.py'))
+        files = sorted(set(files))
+        for fpath in files:
+            functions = ''.join(FUNCTION % (k, k)
+                                for k in xrange(rnd.randrange(1, 20)))
+            _write(fpath, MODULE % {'number': i, 'functions': functions})
+        if i < rules:
+            _write(join(destdir, 'usr/share/python/bcep', dist),
+                   "re||%s/|.*/pkg%d/sub0/mod1\\.py\n"
+                   "dir||%s/sub2/|\n" % (site, i, root))
+        dirs = set()
+        for fpath in files:
+            dpath = dirname(fpath)
+            while dpath.startswith(destdir) and dpath not in dirs:
+                dirs.add(dpath)
+                dpath = dirname(dpath)
+        _write(join(infodir, dist + '.list'),
+               '\n'.join(sorted(dirs) + files) + '\n')
+        result[dist] = files
+    return result
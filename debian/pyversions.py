@@ -8,9 +8,93 @@ except NameError:
     SetType = sets.Set
     set = sets.Set
 
+# resolved versions written at install time, see write_descriptor()
+DESCRIPTOR = '/var/cache/python/pyversions.desc'
+
+def _descriptor_key():
+    """Return mtimes of files the descriptor depends on."""
+    key = []
+    for fn in ('/usr/share/python/debian_defaults', '/usr/bin/python2'):
+        try:
+            key.append(repr(os.lstat(fn).st_mtime))
+        except OSError:
+            key.append('-')
+    return ' '.join(key)
+
+_descriptor = None
+def read_descriptor():
+    """Return values stored by write_descriptor() if they are up to date."""
+    global _descriptor
+    if _descriptor is None:
+        _descriptor = {}
+        try:
+            fp = open(DESCRIPTOR)
+        except IOError:
+            return _descriptor
+        data = {}
+        for line in fp:
+            if line.startswith('#') or not '=' in line:
+                continue
+            name, value = line.split('=', 1)
+            data[name.strip()] = value.strip()
+        fp.close()
+        if data.get('key') == _descriptor_key():
+            _descriptor = data
+    return _descriptor
+
+def write_descriptor(fn=DESCRIPTOR):
+    """Store resolved versions so that next calls do not have to parse
+    debian_defaults, call apt-cache or start the interpreter."""
+    global _descriptor
+    _descriptor = {}  # resolve everything from scratch
+    data = [('key', _descriptor_key())]
+    for name, func in (('supported-versions', supported_versions),
+                       ('old-versions', old_versions),
+                       ('unsupported-versions', unsupported_versions),
+                       ('default-version', default_version)):
+        try:
+            value = func()
+        except ValueError:
+            continue  # keep the slow path (and its error message)
+        if isinstance(value, list):
+            value = ', '.join(value)
+        data.append((name, value))
+    dname = os.path.dirname(fn)
+    if not os.path.isdir(dname):
+        os.makedirs(dname)
+    tmp_fn = '%s.%d' % (fn, os.getpid())
+    fp = open(tmp_fn, 'w')
+    fp.write('# generated by pyversions --write-descriptor, do not edit\n')
+    for name, value in data:
+        fp.write('%s = %s\n' % (name, value))
+    fp.close()
+    os.rename(tmp_fn, fn)
+
+_cached_defaults = None
+def _debpython_defaults():
+    """Return debpython.defaults module (if available)."""
+    global _cached_defaults
+    if _cached_defaults is None:
+        try:
+            # cached debian_defaults and list of installed interpreters
+            from debpython import defaults as _cached_defaults
+        except ImportError:
+            _cached_defaults = False
+    return _cached_defaults
+
 _defaults = None
 def read_default(name=None):
     global _defaults
+    descriptor = read_descriptor()
+    if name in descriptor:
+        return descriptor[name]
+    if _debpython_defaults():
+        if not name:
+            return None
+        value = _cached_defaults.get(name)
+        if value is None:
+            raise ValueError
+        return value
     from ConfigParser import SafeConfigParser, NoOptionError
     if not _defaults:
         if os.path.exists('/usr/share/python/debian_defaults'):
@@ -29,16 +113,45 @@ def read_default(name=None):
         return value
     return None
 
+_VersionRange = None
+def version_range(minv=None, maxv=None, inclusive=False):
+    """Return a function that checks if version ("X.Y") is in given range.
+
+    The maximum version is included if `inclusive` is set or if it's the
+    same as the minimum one. debpython.version.VersionRange is used if
+    available."""
+    global _VersionRange
+    if _VersionRange is None:
+        try:
+            from debpython.version import VersionRange as _VersionRange
+        except ImportError:
+            _VersionRange = False
+    if minv:
+        minv = tuple([int(i) for i in minv.split('.')])
+    if maxv:
+        maxv = tuple([int(i) for i in maxv.split('.')])
+    if _VersionRange:
+        return _VersionRange(minv or None, maxv or None, inclusive).__contains__
+    inclusive = inclusive or (minv and minv == maxv)
+    def match(version):
+        version = tuple([int(i) for i in version.split('.')])
+        if minv and version < minv:
+            return False
+        if maxv and (version > maxv or (version == maxv and not inclusive)):
+            return False
+        return True
+    return match
+
+# maximum version is not included in "<<" range only
+_RANGE_OPERATORS = {'>=': (True, False, False), '<=': (False, True, True),
+                    '<<': (False, True, False)}
+_VERSION_FIELD_RE = re.compile('(>=|<=|<<|=)? *(\d\.\d)$')
+
 def parse_versions(vstring, add_exact=False):
-    import operator
-    operators = { None: operator.eq, '=': operator.eq,
-                  '>=': operator.ge, '<=': operator.le,
-                  '<<': operator.lt
-                  }
     vinfo = {}
     exact_versions = set([])
-    version_range = set(supported_versions(version_only=True)
-                        + old_versions(version_only=True))
+    candidates = set(supported_versions(version_only=True)
+                     + old_versions(version_only=True))
     relop_seen = False
     for field in vstring.split(','):
         field = field.strip()
@@ -49,8 +162,7 @@ def parse_versions(vstring, add_exact=False):
             vinfo['current'] = field
             continue
         vinfo.setdefault('versions', set())
-        ve = re.compile('(>=|<=|<<|=)? *(\d\.\d)$')
-        m = ve.match(field)
+        m = _VERSION_FIELD_RE.match(field)
         try:
             if not m:
                 raise ValueError('error parsing Python-Version attribute')
@@ -63,8 +175,10 @@ def parse_versions(vstring, add_exact=False):
                 exact_versions.add(v)
             else:
                 relop_seen = True
-                filtop = operators[op]
-                version_range = [av for av in version_range if filtop(av ,v)]
+                is_min, is_max, inclusive = _RANGE_OPERATORS[op]
+                match = version_range(is_min and v or None,
+                                      is_max and v or None, inclusive)
+                candidates = [av for av in candidates if match(av)]
         except Exception:
             raise ValueError, 'error parsing Python-Version attribute'
     if add_exact:
@@ -72,14 +186,14 @@ def parse_versions(vstring, add_exact=False):
             vinfo['vexact'] = exact_versions
         if 'versions' in vinfo:
             if relop_seen:
-                vinfo['versions'] = set(version_range)
+                vinfo['versions'] = set(candidates)
             else:
                 del vinfo['versions']
     else:
         if 'versions' in vinfo:
             vinfo['versions'] = exact_versions
             if relop_seen:
-                vinfo['versions'] = exact_versions.union(version_range)
+                vinfo['versions'] = exact_versions.union(candidates)
     return vinfo
 
 _old_versions = None
@@ -136,7 +250,9 @@ def supported_versions(version_only=False):
             fd.close()
             if depends:
                 depends = [re.sub(r'\s*(\S+)[ (]?.*', r'\1', s) for s in depends]
-                _supported_versions = depends
+                # python-all depends on other packages as well
+                _supported_versions = [s for s in depends
+                                       if re.match(r'python\d\.\d+$', s)]
             if not _supported_versions:
                 # last resort: python-minimal not installed, apt-cache
                 # not available, hard code the value, #394084
@@ -151,6 +267,9 @@ if _default_version == 'python':
     _default_version = None
 def default_version(version_only=False):
     global _default_version
+    if not _default_version and 'default-version' in read_descriptor():
+        # consistency with /usr/bin/python2 was checked while writing it
+        _default_version = read_descriptor()['default-version']
     if not _default_version:
         try:
             _default_version = link = os.readlink('/usr/bin/python2')
@@ -224,11 +343,15 @@ def requested_versions(vstring, version_only=False):
         return ['python%s' % v for v in versions]
 
 def installed_versions(version_only=False):
-    import glob
     supported = supported_versions()
-    versions = [os.path.basename(s)
-                for s in glob.glob('/usr/bin/python[0-9].[0-9]')
-                if os.path.basename(s) in supported]
+    if _debpython_defaults():
+        versions = [s for s in _cached_defaults.installed()
+                    if s in supported]
+    else:
+        import glob
+        versions = [os.path.basename(s)
+                    for s in glob.glob('/usr/bin/python[0-9].[0-9]')
+                    if os.path.basename(s) in supported]
     versions.sort()
     if version_only:
         return [v[6:] for v in versions]
@@ -298,21 +421,16 @@ def requested_versions_bis(vstring, version_only=False):
     for item in vstring.split(','):
         v=item.split('-')
         if len(v)>1:
-            if not v[0]:
-                v[0] = py_supported_short[0]
-            if not v[1]:
-                v[1] = py_supported_short[-1]
-            for ver in py_supported_short:
-                try:
-                    if version_cmp(ver,v[0]) >= 0 \
-                           and version_cmp(ver,v[1]) <= 0:
-                        versions.append(ver)
-                except ValueError:
-                    pass
+            try:
+                match = version_range(v[0], v[1], inclusive=True)
+            except ValueError:
+                continue
+            versions.extend([ver for ver in py_supported_short
+                             if match(ver)])
         else:
             if v[0] in py_supported_short:
                 versions.append(v[0])
-    versions.sort(version_cmp)
+    versions.sort(key=lambda ver: tuple([int(i) for i in ver.split('.')]))
     if not versions:
         raise ValueError, 'empty set of versions'
     if not version_only:
@@ -339,13 +457,22 @@ def main():
     parser.add_option('-i', '--installed',
                       help='print the installed supported python versions',
                       action='store_true', dest='installed')
+    parser.add_option('--write-descriptor',
+                      help='store resolved versions in %s (used by maintainer scripts)' % DESCRIPTOR,
+                      action='store_true', dest='write_descriptor')
     parser.add_option('-v', '--version',
                       help='print just the version number(s)',
                       default=False, action='store_true', dest='version_only')
     opts, args = parser.parse_args()
     program = os.path.basename(sys.argv[0])
 
-    if opts.default and len(args) == 0:
+    if opts.write_descriptor and len(args) == 0:
+        try:
+            write_descriptor()
+        except (IOError, OSError), msg:
+            sys.stderr.write("%s: cannot write %s: %s\n" % (program, DESCRIPTOR, msg))
+            sys.exit(1)
+    elif opts.default and len(args) == 0:
         try:
             print default_version(opts.version_only)
         except ValueError, msg:
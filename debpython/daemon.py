@@ -0,0 +1,215 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Long-lived byte compilation server.
+
+pycompile starts one server per interpreter (and optimization level) on
+first use, see connect(). The server reads the client's working directory
+followed by file names (one per line) from a Unix socket, compiles them and
+streams back the same records as debpython.worker does. Once the client
+closes its side of the connection, the exit status is sent. The server exits
+after IDLE_TIMEOUT seconds without clients.
+
+This file is executed by the interpreter it compiles for, so it has to use
+the standard library only.
+"""
+
+from __future__ import with_statement
+import errno
+import logging
+import os
+import socket
+import sys
+import time
+from os import environ
+from os.path import dirname, join
+from subprocess import Popen
+try:
+    from debpython import worker
+except ImportError:  # executed as a script by other interpreter
+    import worker
+
+log = logging.getLogger(__name__)
+
+SOCKET_DIR = '/run/pycompile'
+IDLE_TIMEOUT = 60  # seconds
+START_TIMEOUT = 5  # seconds
+
+
+def socket_path(version, optimize=False):
+    """Return path to the socket of the server for given interpreter.
+
+    >>> socket_path('2.7', False).endswith('/python2.7.sock')
+    True
+    >>> socket_path('2.7', True).endswith('/python2.7-O.sock')
+    True
+    """
+    dname = environ.get('PYCOMPILE_DAEMON_DIR', SOCKET_DIR)
+    return join(dname, "python%s%s.sock" % (version, '-O' if optimize else ''))
+
+
+class Client(object):
+    """Popen-like handle of a connection to the compile server.
+
+    File names written to `stdin` are compiled by the server, records are
+    read from `stdout` (both are the connection itself, see
+    debpython.worker.Collector). `returncode` has to be set once the exit
+    status is received.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.stdin = self.stdout = self
+        self.returncode = None
+        self.write(os.getcwd() + '\n')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        """Tell the server there are no more files to compile."""
+        self.sock.shutdown(socket.SHUT_WR)
+
+    def wait(self):
+        self.sock.close()
+        if self.returncode is None:
+            # connection closed before the server reported the status
+            log.error('compile server terminated unexpectedly')
+            self.returncode = 1
+        return self.returncode
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def connect(version, optimize=False):
+    """Return Client connected to the server, start the server if needed.
+
+    :return: None if the server cannot be started
+    """
+    path = socket_path(version, optimize)
+    try:
+        return Client(_connect(path))
+    except socket.error, e:
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            log.debug('cannot connect to %s: %s', path, e)
+            return None
+
+    try:
+        if not os.path.isdir(dirname(path)):
+            os.makedirs(dirname(path), 0700)
+        cmd = ["/usr/bin/python%s" % version, __file__.rstrip('co'), path]
+        if optimize:
+            cmd.insert(1, '-O')
+        with open(os.devnull, 'r+') as devnull:
+            Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull,
+                  close_fds=True, cwd='/', preexec_fn=os.setsid)
+    except (IOError, OSError), e:
+        log.debug('cannot start compile server for Python %s: %s', version, e)
+        return None
+
+    timeout = time.time() + START_TIMEOUT
+    while time.time() < timeout:
+        try:
+            return Client(_connect(path))
+        except socket.error:
+            time.sleep(0.01)
+    log.debug('compile server for Python %s did not start', version)
+    return None
+
+
+def handle(conn):
+    """Compile files sent over given connection."""
+    infile = conn.makefile('rb')
+    outfile = conn.makefile('wb')
+    os.chdir(infile.readline().rstrip('\n') or '/')
+    rv = worker.compile_files(infile, outfile)
+    outfile.write("exit\t%d\n" % rv)
+    outfile.close()
+    infile.close()
+
+
+def serve(path, timeout=IDLE_TIMEOUT):
+    """Accept clients until there is none for `timeout` seconds."""
+    try:
+        _connect(path).close()
+    except socket.error:
+        pass
+    else:
+        return  # another server is already running
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0600)
+    inode = os.stat(path).st_ino
+    server.listen(16)
+    server.settimeout(timeout)
+    while True:
+        try:
+            conn, addr = server.accept()
+        except socket.timeout:
+            break
+        conn.settimeout(None)
+        try:
+            handle(conn)
+        except Exception:
+            log.exception('cannot handle client')
+        finally:
+            conn.close()
+
+    # new clients will start a new server, handle the ones already queued
+    try:
+        if os.stat(path).st_ino == inode:
+            os.remove(path)
+    except OSError:
+        pass
+    server.setblocking(0)
+    while True:
+        try:
+            conn, addr = server.accept()
+        except socket.error:
+            break
+        conn.setblocking(1)
+        try:
+            handle(conn)
+        except Exception:
+            log.exception('cannot handle client')
+        finally:
+            conn.close()
+    server.close()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
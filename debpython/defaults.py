@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Cached view of debian_defaults and installed interpreters.
+
+debian_defaults is parsed (and /usr/bin scanned) only if one of them was
+modified since the state file was written, see load().
+"""
+
+from __future__ import with_statement
+import logging
+import marshal
+import re
+from ConfigParser import SafeConfigParser, Error as ConfigError
+from glob import glob
+from os import environ, getpid, makedirs, rename, stat
+from os.path import basename, dirname, exists
+
+from debpython.tools import memoize, CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+FORMAT = 1  # bump it if the state file's format changes
+DEFAULTS_FILE = '/usr/share/python/debian_defaults'
+BIN_DIR = '/usr/bin'
+INTERPRETER_RE = re.compile(r'python\d\.\d+$')
+
+
+def state_path():
+    """Return path to the state file (DESTDIR is used in tests).
+
+    >>> state_path().endswith('/var/cache/python/defaults.state')
+    True
+    """
+    return "%s%s/defaults.state" % (environ.get('DESTDIR', ''), CACHE_DIR)
+
+
+def sources():
+    """Return (file name, mtime) pairs the state depends on."""
+    result = []
+    for fpath in (environ.get('DESTDIR', '') + DEFAULTS_FILE, BIN_DIR):
+        try:
+            mtime = stat(fpath).st_mtime
+        except OSError:
+            mtime = None
+        result.append((fpath, mtime))
+    return tuple(result)
+
+
+def parse(fpath, bin_dir=BIN_DIR):
+    """Return options from debian_defaults and installed interpreters."""
+    config = SafeConfigParser()
+    try:
+        config.read(fpath)
+    except ConfigError, e:
+        log.warn('cannot parse %s: %s', fpath, e)
+    interpreters = (basename(i) for i in glob("%s/python*" % bin_dir))
+    return {'options': dict(config.defaults()),
+            'installed': sorted(i for i in interpreters
+                                if INTERPRETER_RE.match(i))}
+
+
+@memoize
+def load():
+    """Return {'options': {name: value}, 'installed': [pythonX.Y, ...]}.
+
+    Result is kept in the state file, it's regenerated if debian_defaults
+    or /usr/bin was modified.
+    """
+    key = sources()
+    fpath = state_path()
+    try:
+        with open(fpath, 'rb') as fp:
+            data = marshal.load(fp)
+        if data[:2] == (FORMAT, key):
+            return data[2]
+    except (IOError, OSError, EOFError, ValueError, TypeError, IndexError):
+        pass
+
+    result = parse(key[0][0])
+    tmp_fpath = "%s.%s" % (fpath, getpid())
+    try:
+        if not exists(dirname(fpath)):
+            makedirs(dirname(fpath))
+        with open(tmp_fpath, 'wb') as fp:
+            marshal.dump((FORMAT, key, result), fp)
+        rename(tmp_fpath, fpath)
+    except (IOError, OSError), e:
+        log.debug('cannot save %s: %s', fpath, e)
+    return result
+
+
+def get(name, default=None):
+    """Return value of given option from debian_defaults."""
+    return load()['options'].get(name, default)
+
+
+def installed():
+    """Return names of installed interpreters (f.e. ['python2.7'])."""
+    return load()['installed']
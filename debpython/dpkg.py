@@ -0,0 +1,318 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Read-only access to dpkg's database (no dpkg subprocesses)."""
+
+from __future__ import with_statement
+import logging
+import marshal
+import sys
+from glob import glob
+from os import environ, getpid, listdir, makedirs, rename, stat
+from os.path import dirname, exists, join
+
+from debpython.tools import memoize, CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+OWNERS_FORMAT = 1  # bump it if OwnerIndex's cache format changes
+
+# parsed *.list files: {path: (mtime, list of file names)}
+_LISTS = {}
+
+
+class NotInstalledError(Exception):
+    """Raised if package's file list is not available."""
+
+    def __init__(self, package):
+        Exception.__init__(self, "cannot get content of %s" % package)
+        self.package = package
+
+
+def infodir():
+    """Return path to dpkg's info directory (DPKG_ADMINDIR is honoured)."""
+    return join(environ.get('DPKG_ADMINDIR', '/var/lib/dpkg'), 'info')
+
+
+def list_fpaths(package):
+    """Return paths to *.list files of given package.
+
+    Multi-Arch: same packages are stored as package:arch.list, other
+    packages as package.list (even if architecture qualified name is used)
+
+    >>> from tempfile import mkdtemp
+    >>> from os import mkdir
+    >>> admindir = mkdtemp()
+    >>> mkdir(admindir + '/info')
+    >>> for fn in ('foo.list', 'bar:amd64.list', 'bar:i386.list'):
+    ...     open(join(admindir, 'info', fn), 'w').write('/usr\\n')
+    >>> environ['DPKG_ADMINDIR'] = admindir
+    >>> [i[len(admindir):] for i in list_fpaths('foo')]
+    ['/info/foo.list']
+    >>> [i[len(admindir):] for i in list_fpaths('bar')]
+    ['/info/bar:amd64.list', '/info/bar:i386.list']
+    >>> [i[len(admindir):] for i in list_fpaths('bar:i386')]
+    ['/info/bar:i386.list']
+    >>> [i[len(admindir):] for i in list_fpaths('foo:amd64')]
+    ['/info/foo.list']
+    >>> list_fpaths('bar:armel'), list_fpaths('baz')
+    ([], [])
+    >>> del environ['DPKG_ADMINDIR']
+    >>> from shutil import rmtree; rmtree(admindir)
+    """
+    dname = infodir()
+    fpath = join(dname, "%s.list" % package)
+    try:
+        stat(fpath)
+    except OSError:
+        if ':' in package:
+            fpath = join(dname, "%s.list" % package.split(':', 1)[0])
+            return [fpath] if exists(fpath) else []
+        return sorted(glob(join(dname, "%s:*.list" % package)))
+    return [fpath]
+
+
+def read_list(fpath):
+    """Return file names listed in given *.list file.
+
+    Files are parsed once, as long as their mtime doesn't change.
+
+    >>> from tempfile import mkstemp
+    >>> from os import close, remove, utime
+    >>> fd, fpath = mkstemp('.list')
+    >>> close(fd)
+    >>> open(fpath, 'w').write('/usr\\n/usr/bin\\n')
+    >>> utime(fpath, (1000, 1000))
+    >>> result = read_list(fpath)
+    >>> result, read_list(fpath) is result
+    (['/usr', '/usr/bin'], True)
+    >>> open(fpath, 'w').write('/usr\\n')
+    >>> utime(fpath, (1000, 1000))  # mtime didn't change: cached result
+    >>> read_list(fpath)
+    ['/usr', '/usr/bin']
+    >>> utime(fpath, (2000, 2000))
+    >>> read_list(fpath)
+    ['/usr']
+    >>> remove(fpath)
+    """
+    mtime = stat(fpath).st_mtime
+    cached = _LISTS.get(fpath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(fpath, 'r') as fp:
+        result = fp.read().splitlines()
+    _LISTS[fpath] = (mtime, result)
+    return result
+
+
+def files(packages, missing=None):
+    """Generate (package, file names) pairs for all given packages.
+
+    :param packages: package name or a list of package names
+    :param missing: list to append names of packages that are not
+        installed to (they're skipped with a warning), NotInstalledError
+        is raised if it's not set
+    :raise NotInstalledError: if one of the packages is not installed
+
+    >>> from tempfile import mkdtemp
+    >>> from os import mkdir
+    >>> admindir = mkdtemp()
+    >>> mkdir(admindir + '/info')
+    >>> open(admindir + '/info/foo.list', 'w').write('/usr\\n/usr/foo\\n')
+    >>> open(admindir + '/info/bar:amd64.list', 'w').write('/usr/bar\\n')
+    >>> open(admindir + '/info/bar:i386.list', 'w').write('/usr/bar32\\n')
+    >>> environ['DPKG_ADMINDIR'] = admindir
+    >>> list(files('foo'))
+    [('foo', ['/usr', '/usr/foo'])]
+    >>> list(files(['bar', 'foo']))[0]
+    ('bar', ['/usr/bar', '/usr/bar32'])
+    >>> list(files(['foo', 'baz']))
+    Traceback (most recent call last):
+      ...
+    NotInstalledError: cannot get content of baz
+    >>> missing = []
+    >>> [i[0] for i in files(['baz', 'foo'], missing)], missing
+    (['foo'], ['baz'])
+    >>> del environ['DPKG_ADMINDIR']
+    >>> from shutil import rmtree; rmtree(admindir)
+    """
+    if isinstance(packages, basestring):
+        packages = [packages]
+    for package in packages:
+        try:
+            result = _package_files(package)
+        except NotInstalledError, e:
+            if missing is None:
+                raise
+            log.warning('%s, package skipped', e)
+            missing.append(package)
+            continue
+        yield package, result
+
+
+def _package_files(package):
+    fpaths = list_fpaths(package)
+    if not fpaths:
+        raise NotInstalledError(package)
+    result = []
+    for fpath in fpaths:
+        try:
+            result.extend(read_list(fpath))
+        except (IOError, OSError), e:
+            log.debug(e)
+            raise NotInstalledError(package)
+    return result
+
+
+def expand_packages(names, stdin=None):
+    """Return package names, replace "-" with names read from stdin.
+
+    Duplicates are removed (the order is preserved).
+
+    >>> from StringIO import StringIO
+    >>> expand_packages(['foo', '-', 'bar'], StringIO('baz foo\\nqux\\n'))
+    ['foo', 'baz', 'qux', 'bar']
+    """
+    result = []
+    seen = set()
+    for name in names:
+        if name == '-':
+            items = (stdin or sys.stdin).read().split()
+        else:
+            items = [name]
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                result.append(item)
+    return result
+
+
+class OwnerIndex(object):
+    """Map paths to packages that ship them, built from all *.list files.
+
+    :param suffix: index only paths that end with given suffix
+    :param cache: file to keep the index in between runs; it's rebuilt if
+        dpkg's info directory was modified
+
+    >>> from tempfile import mkdtemp
+    >>> from os import mkdir, utime
+    >>> admindir = mkdtemp()
+    >>> mkdir(admindir + '/info')
+    >>> open(admindir + '/info/foo.list', 'w').write('/usr\\n/usr/foo.py\\n')
+    >>> open(admindir + '/info/bar.list', 'w').write('/usr/bar.py\\n/usr/x\\n')
+    >>> open(admindir + '/info/foo.md5sums', 'w').write('')
+    >>> utime(admindir + '/info', (1000, 1000))
+    >>> environ['DPKG_ADMINDIR'] = admindir
+    >>> index = OwnerIndex('.py', cache=admindir + '/owners')
+    >>> len(index), index.owner('/usr/foo.py'), '/usr/bar.py' in index
+    (2, 'foo', True)
+    >>> '/usr/x' in index, index.owner('/usr/baz.py')
+    (False, None)
+
+    Cached index is used until dpkg's info directory is modified:
+
+    >>> open(admindir + '/info/baz.list', 'w').write('/usr/baz.py\\n')
+    >>> utime(admindir + '/info', (1000, 1000))
+    >>> OwnerIndex('.py', cache=admindir + '/owners').owner('/usr/baz.py')
+    >>> utime(admindir + '/info', (2000, 2000))
+    >>> OwnerIndex('.py', cache=admindir + '/owners').owner('/usr/baz.py')
+    'baz'
+    >>> del environ['DPKG_ADMINDIR']
+    >>> from shutil import rmtree; rmtree(admindir)
+    """
+
+    def __init__(self, suffix='', cache=None):
+        self.suffix = suffix
+        dname = infodir()
+        try:
+            mtime = stat(dname).st_mtime
+        except OSError, e:
+            log.debug('cannot read dpkg database: %s', e)
+            self.index = {}
+            return
+        self.index = self._load(cache, dname, mtime) if cache else None
+        if self.index is None:
+            self.index = self._build(dname)
+            if cache:
+                self._dump(cache, dname, mtime)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def owner(self, path):
+        """Return name of (one of) the package(s) that ship given path."""
+        return self.index.get(path)
+
+    def _build(self, dname):
+        suffix = self.suffix
+        index = {}
+        for fn in listdir(dname):
+            if not fn.endswith('.list'):
+                continue
+            package = intern(fn[:-5])
+            with open(join(dname, fn), 'r') as fp:
+                for line in fp:
+                    line = line.rstrip('\n')
+                    if line.endswith(suffix) and line not in index:
+                        index[line] = package
+        return index
+
+    def _load(self, fpath, dname, mtime):
+        try:
+            with open(fpath, 'rb') as fp:
+                data = marshal.load(fp)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if data[:4] != (OWNERS_FORMAT, dname, mtime, self.suffix):
+            log.debug('%s is outdated', fpath)
+            return None
+        return data[4]
+
+    def _dump(self, fpath, dname, mtime):
+        data = (OWNERS_FORMAT, dname, mtime, self.suffix, self.index)
+        tmp_fpath = "%s.%s" % (fpath, getpid())
+        try:
+            if not exists(dirname(fpath)):
+                makedirs(dirname(fpath))
+            with open(tmp_fpath, 'wb') as fp:
+                marshal.dump(data, fp)
+            rename(tmp_fpath, fpath)
+        except (IOError, OSError), e:
+            log.debug('cannot save %s: %s', fpath, e)
+
+
+def owners_cache(name):
+    """Return path to OwnerIndex's cache file (DESTDIR is used in tests).
+
+    >>> owners_cache('init').endswith('/var/cache/python/dpkg-owners.init')
+    True
+    """
+    return "%s%s/dpkg-owners.%s" % (environ.get('DESTDIR', ''),
+                                     CACHE_DIR, name)
+
+
+@memoize
+def init_owners():
+    """Return OwnerIndex of all __init__.py files shipped by packages."""
+    return OwnerIndex('/__init__.py', owners_cache('init'))
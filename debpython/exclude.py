@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import re
+
+EMPTY = frozenset()
+BACKREF_RE = re.compile(r'\\[1-9]|\(\?P[<=]')
+MAX_GROUPS = 99  # re module supports up to 100 groups in one pattern
+
+
+def combine(patterns):
+    """Return a list of regular expressions equivalent to given ones.
+
+    Patterns without flags and back references are merged into alternations.
+
+    >>> pats = combine([re.compile(r'a.*'), re.compile(r'(b|c)d'),
+    ...                 re.compile(r'(?i)e')])
+    >>> len(pats)
+    2
+    >>> [any(p.match(i) for p in pats) for i in ('ax', 'cd', 'bx', 'E')]
+    [True, True, False, True]
+    """
+    result = []
+    chunk = []
+    groups = 0
+    for pattern in patterns:
+        if pattern.flags or BACKREF_RE.search(pattern.pattern):
+            result.append(pattern)
+            continue
+        if chunk and groups + pattern.groups > MAX_GROUPS:
+            result.append(_merge(chunk))
+            chunk = []
+            groups = 0
+        chunk.append(pattern)
+        groups += pattern.groups
+    if chunk:
+        result.append(_merge(chunk))
+    return result
+
+
+def _merge(patterns):
+    if len(patterns) == 1:
+        return patterns[0]
+    return re.compile('|'.join("(?:%s)" % i.pattern for i in patterns))
+
+
+class ExcludeMatcher(object):
+    """Match file names against all exclusion rules at once.
+
+    `dir` rules are stored in a tree of path components (the last component
+    of a rule is matched as a prefix), `re` rules with the same set of
+    versions are merged into one regular expression.
+
+    :param patterns: (type, versions, directory, pattern) tuples (see
+        pycompile's get_exclude_patterns())
+
+    >>> matcher = ExcludeMatcher([('dir', set([(2, 6)]), '/usr/foo', None),
+    ...     ('dir', set([(2, 7)]), '/usr/foo/bar/', None),
+    ...     ('re', set([(2, 7)]), '/', re.compile(r'.*/test_'))])
+    >>> sorted(matcher.match('/usr/foobar/baz.py'))
+    [(2, 6)]
+    >>> sorted(matcher.match('/usr/foo/bar/baz.py'))
+    [(2, 6), (2, 7)]
+    >>> sorted(matcher.match('/usr/lib/test_baz.py'))
+    [(2, 7)]
+    >>> sorted(matcher.match('/usr/fo.py'))
+    []
+    """
+
+    def __init__(self, patterns):
+        self.tree = ({}, [])  # (children, [(prefix, versions), ...])
+        self.has_dirs = False
+        regexprs = {}
+        for type_, versions, dname, pattern in patterns:
+            versions = frozenset(versions)
+            if type_ == 'dir':
+                self.add_dir(dname, versions)
+            elif type_ == 're':
+                regexprs.setdefault(versions, []).append(pattern)
+        self.regexprs = []
+        for versions, items in regexprs.iteritems():
+            for pattern in combine(items):
+                self.regexprs.append((pattern, versions))
+
+    def add_dir(self, dname, versions):
+        """Exclude files that start with given directory name."""
+        parts = dname.split('/')
+        node = self.tree
+        for part in parts[:-1]:
+            node = node[0].setdefault(part, ({}, []))
+        node[1].append((parts[-1], versions))
+        self.has_dirs = True
+
+    def match_dir(self, fpath):
+        """Return versions given file is excluded for by `dir` rules."""
+        result = EMPTY
+        node = self.tree
+        for part in fpath.split('/'):
+            children, prefixes = node
+            for prefix, versions in prefixes:
+                if part.startswith(prefix):
+                    result = result | versions
+            node = children.get(part)
+            if node is None:
+                break
+        return result
+
+    def match(self, fpath):
+        """Return versions given file is excluded for."""
+        result = self.match_dir(fpath) if self.has_dirs else EMPTY
+        for pattern, versions in self.regexprs:
+            if not versions <= result and pattern.match(fpath):
+                result = result | versions
+        return result
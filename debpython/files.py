@@ -20,40 +20,134 @@
 # THE SOFTWARE.
 
 import logging
-from os import walk
+from os import listdir, lstat, stat
 from os.path import abspath, isfile, join
-from subprocess import Popen, PIPE
+from stat import S_ISDIR, S_ISLNK
+# Python 2.7 doesn't provide os.scandir and nothing depends on the scandir
+# module (python-scandir), so listdir() + lstat() is used unless it's
+# installed by hand. Subtrees are pruned before they're scanned either way.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from debpython import dpkg
 
 log = logging.getLogger(__name__)
 
 
-def from_directory(dname, extensions=('.py',)):
-    """Generate *.py file names available in given directory."""
+def _scan(dname):
+    """Generate (name, is directory, stat function) for given directory.
+
+    Stat function (which follows symlinks) is None for directories that
+    are not symlinks, i.e. the ones os.walk would descend into.
+    """
+    if scandir is not None:
+        for entry in scandir(dname):
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, True, None
+            else:
+                yield entry.name, entry.is_dir(), entry.stat
+        return
+    for name in listdir(dname):
+        fpath = join(dname, name)
+        try:
+            fstat = lstat(fpath)
+        except OSError:
+            continue
+        if S_ISDIR(fstat.st_mode):
+            yield name, True, None
+        elif S_ISLNK(fstat.st_mode):
+            try:
+                fstat = stat(fpath)
+            except OSError:  # dangling symlink
+                yield name, False, lambda fpath=fpath: stat(fpath)
+            else:
+                yield name, S_ISDIR(fstat.st_mode), lambda fstat=fstat: fstat
+        else:
+            yield name, False, lambda fstat=fstat: fstat
+
+
+def walk_files(dname, extensions=('.py',), prune=None):
+    """Generate (file name, stat) pairs for files available in given directory.
+
+    stat is None for dangling symlinks.
+
+    :param prune: function called with directory names (ending with a
+        slash), subtrees it returns True for are not scanned
+    """
     extensions = tuple(extensions)  # .endswith doesn't like list
     if isinstance(dname, (list, tuple)):
         for item in dname:
-            for fn in from_directory(item):
-                yield fn
-    elif isfile(dname) and dname.endswith(extensions):
-        yield dname
-    else:
-        for root, dirs, file_names in walk(abspath(dname)):
-            for fn in file_names:
-                if fn.endswith(extensions):
-                    yield join(root, fn)
-
-
-def from_package(package_name, extensions=('.py',)):
-    """Generate *.py file names available in given package."""
+            for pair in walk_files(item, extensions, prune):
+                yield pair
+        return
+    if isfile(dname):
+        if dname.endswith(extensions):
+            yield dname, stat(dname)
+        return
+
+    dirs = [abspath(dname)]
+    while dirs:
+        root = dirs.pop()
+        if prune is not None and prune(root.rstrip('/') + '/'):
+            log.debug('skipping excluded directory: %s', root)
+            continue
+        try:
+            entries = list(_scan(root))
+        except OSError:
+            continue
+        subdirs = []
+        for name, is_dir, stat_func in entries:
+            if stat_func is None:
+                subdirs.append(join(root, name))
+            elif not is_dir and name.endswith(extensions):
+                try:
+                    fstat = stat_func()
+                except OSError:
+                    fstat = None
+                yield join(root, name), fstat
+        subdirs.reverse()  # visit them in listing order
+        dirs.extend(subdirs)
+
+
+def from_directory(dname, extensions=('.py',)):
+    """Generate *.py file names available in given directory."""
+    for fn, fstat in walk_files(dname, extensions):
+        yield fn
+
+
+def orphaned_bytecode(dname):
+    """Generate (file name, size) pairs of .py[co] files without source.
+
+    Given directory (or a list of directories) is scanned only once.
+    """
+    sources = set()
+    bytecode = []
+    for fpath, fstat in walk_files(dname, ('.py', '.pyc', '.pyo')):
+        if fpath.endswith('.py'):
+            sources.add(fpath)
+        else:
+            bytecode.append((fpath, fstat.st_size if fstat else 0))
+    for fpath, size in bytecode:
+        if fpath[:-1] not in sources:
+            yield fpath, size
+
+
+def from_package(package_name, extensions=('.py',), missing=None):
+    """Generate *.py file names available in given package(s).
+
+    :param package_name: package name or a list of package names
+    :param missing: see dpkg.files()
+    """
     extensions = tuple(extensions)  # .endswith doesn't like list
-    process = Popen("/usr/bin/dpkg -L %s" % package_name,\
-                    shell=True, stdout=PIPE)
-    stdout, stderr = process.communicate()
-    if process.returncode != 0:
-        raise Exception("cannot get content of %s" % package_name)
-    for line in stdout.splitlines():
-        if line.endswith(extensions):
-            yield line
+    for package, file_names in dpkg.files(package_name, missing):
+        for line in file_names:
+            if line.endswith(extensions):
+                yield line
 
 
 def filter_directory(files, dname):
@@ -0,0 +1,444 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Manifests of byte-compiled files.
+
+A manifest records size, mtime and SHA-1 digest of every source file
+compiled in given site directory. Entries are valid only for the
+interpreter magic number stored in the manifest.
+
+Manifests that are marked as complete (all files in the directory were
+processed) are used as a journal by runtime hooks: there is no need to
+scan the directory to find out which files have to be recompiled (or
+removed).
+"""
+
+from __future__ import with_statement
+import imp
+import logging
+import marshal
+import struct
+import sys
+from fcntl import flock, LOCK_EX
+from hashlib import sha1
+from os import close, environ, getpid, makedirs, remove, rename
+from os.path import dirname, exists
+from subprocess import Popen, PIPE
+
+from debpython.tools import memoize, CACHE_DIR, PUBLIC_DIR_RE
+
+log = logging.getLogger(__name__)
+
+FORMAT = 2  # bump it if manifest's format changes
+
+
+def manifest_path(dname, optimize=False):
+    """Return path to the manifest of given directory.
+
+    >>> manifest_path('/usr/lib/python2.7/dist-packages/').endswith(
+    ...     '/var/cache/python/pycompile/usr_lib_python2.7_dist-packages.pyc')
+    True
+    """
+    # DESTDIR is used in tests
+    return "%s%s/pycompile/%s.py%s" % (environ.get('DESTDIR', ''), CACHE_DIR,
+                                       dname.strip('/').replace('/', '_'),
+                                       'o' if optimize else 'c')
+
+
+@memoize
+def interpreter_magic(version):
+    """Return byte-code magic number of given interpreter."""
+    if version == "%d.%d" % sys.version_info[:2]:
+        return imp.get_magic()
+    process = Popen(["/usr/bin/python%s" % version, '-c',
+                     'import imp, sys; sys.stdout.write(imp.get_magic())'],
+                    stdout=PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0 or len(stdout) != 4:
+        raise Exception("cannot get magic number of Python %s" % version)
+    return stdout
+
+
+def file_digest(fpath):
+    """Return SHA-1 digest of given file's content."""
+    result = sha1()
+    with open(fpath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), ''):
+            result.update(chunk)
+    return result.digest()
+
+
+def update_timestamp(cfpath, magic, mtime):
+    """Store new source file's mtime in byte-code file's header.
+
+    :return: False if the byte-code file was generated for a different
+        interpreter (or cannot be modified)
+    """
+    try:
+        with open(cfpath, 'r+b') as fp:
+            if fp.read(4) != magic:
+                return False
+            fp.seek(4)
+            fp.write(struct.pack('<I', int(mtime) & 0xFFFFFFFF))
+    except (IOError, OSError), e:
+        log.debug('cannot update %s: %s', cfpath, e)
+        return False
+    return True
+
+
+def header_matches(cfpath, magic, mtime):
+    """Check if byte-code file was compiled from source with given mtime.
+
+    The same check is done by the import system: magic number and source
+    file's mtime stored in byte-code file's header have to match (file's
+    own mtime is meaningless, dpkg sets mtimes from the archive).
+
+    >>> from tempfile import mkstemp
+    >>> fd, cfpath = mkstemp('.pyc')
+    >>> close(fd)
+    >>> open(cfpath, 'wb').write('MAG1' + struct.pack('<I', 1000))
+    >>> header_matches(cfpath, 'MAG1', 1000.5)
+    True
+    >>> header_matches(cfpath, 'MAG1', 978307200), \\
+    ...     header_matches(cfpath, 'MAG2', 1000)
+    (False, False)
+    >>> remove(cfpath)
+    >>> header_matches(cfpath, 'MAG1', 1000)
+    False
+    """
+    try:
+        with open(cfpath, 'rb') as fp:
+            header = fp.read(8)
+    except (IOError, OSError):
+        return False
+    return header == magic + struct.pack('<I', int(mtime) & 0xFFFFFFFF)
+
+
+class Manifest(object):
+    """Byte-compiled files in one directory (for one interpreter).
+
+    :param fpath: manifest file name (see manifest_path())
+    :param magic: magic number of the interpreter used to compile files,
+        None to accept the one stored in the manifest
+
+    >>> from tempfile import mkdtemp
+    >>> from os import stat
+    >>> tmp = mkdtemp()
+    >>> fpath = tmp + '/foo.py'
+    >>> open(fpath, 'w').write('x = 1\\n')
+    >>> open(fpath + 'c', 'wb').write('MAG1\\0\\0\\0\\0')
+    >>> manifest = Manifest(tmp + '/cache/manifest.pyc', 'MAG1')
+    >>> manifest.exists, manifest.complete
+    (False, False)
+    >>> manifest.add(fpath, stat(fpath))
+    >>> manifest.complete = True
+    >>> manifest.save()
+    >>> manifest = Manifest(tmp + '/cache/manifest.pyc', 'MAG1')
+    >>> manifest.exists, manifest.complete, list(manifest) == [fpath]
+    (True, True, True)
+    >>> manifest.is_current(fpath, fpath + 'c', stat(fpath))
+    True
+
+    Files compiled by a different interpreter are outdated:
+
+    >>> manifest = Manifest(tmp + '/cache/manifest.pyc', 'MAG2')
+    >>> manifest.entries, list(manifest.outdated) == [fpath]
+    ({}, True)
+    >>> manifest.save()  # outdated file wasn't recompiled
+    >>> Manifest(tmp + '/cache/manifest.pyc').complete
+    False
+
+    Forgotten files (f.e. removed by pyclean) do not make the manifest
+    incomplete, files that failed to compile do:
+
+    >>> manifest = Manifest(tmp + '/cache/manifest.pyc', 'MAG1')
+    >>> manifest.add(fpath, stat(fpath))
+    >>> manifest.complete = True
+    >>> manifest.save()
+    >>> manifest.discard(fpath)
+    >>> manifest.complete, manifest.modified
+    (True, True)
+    >>> manifest.add(fpath, stat(fpath))  # sent to the interpreter...
+    >>> manifest.discard(fpath)  # ... but it failed to compile
+    >>> manifest.complete
+    False
+
+    Changes are merged with the ones saved by other processes meanwhile:
+
+    >>> open(tmp + '/bar.py', 'w').write('y = 1\\n')
+    >>> first = Manifest(tmp + '/cache/manifest.pyc', 'MAG1')
+    >>> second = Manifest(tmp + '/cache/manifest.pyc', 'MAG1')
+    >>> first.add(fpath, stat(fpath))
+    >>> first.save()
+    >>> second.add(tmp + '/bar.py', stat(tmp + '/bar.py'))
+    >>> second.save()
+    >>> sorted(i[len(tmp):] for i in Manifest(tmp + '/cache/manifest.pyc'))
+    ['/bar.py', '/foo.py']
+    >>> from shutil import rmtree; rmtree(tmp)
+    """
+
+    def __init__(self, fpath, magic=None):
+        self.fpath = fpath
+        self.magic = magic
+        self.exists = False
+        self.complete = False
+        self.entries = {}  # {source file: (size, mtime, digest)}
+        self.outdated = set()  # files compiled with a different interpreter
+        self.pending = {}  # {source file: (size, mtime)}
+        self.changes = {}  # {source file: new entry or None}, see save()
+        self.modified = False
+        data = self._read()
+        if data is None:
+            if exists(fpath):
+                self.modified = True  # invalid or outdated format
+            self._loaded_complete = False
+            return
+        format_, magic, self.complete, entries = data
+        self._loaded_complete = self.complete
+        self.exists = True
+        if self.magic is None:
+            self.magic = magic
+        if magic == self.magic:
+            self.entries = entries
+        else:
+            self.outdated = set(entries)
+            self.modified = True
+
+    def _read(self):
+        """Return data stored in manifest file (None if not valid)."""
+        try:
+            with open(self.fpath, 'rb') as fp:
+                data = marshal.load(fp)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, tuple) or len(data) != 4 or \
+           data[0] != FORMAT:
+            return None
+        return data
+
+    def _set(self, fpath, entry):
+        self.entries[fpath] = entry
+        self.changes[fpath] = entry
+        self.modified = True
+
+    def __contains__(self, fpath):
+        return fpath in self.entries or fpath in self.outdated
+
+    def __iter__(self):
+        """Generate names of all recorded files (outdated ones as well)."""
+        for fpath in self.entries:
+            yield fpath
+        for fpath in self.outdated:
+            if fpath not in self.entries:
+                yield fpath
+
+    def is_current(self, fpath, cfpath, fstat):
+        """Check if byte-code file doesn't have to be regenerated.
+
+        If only source file's mtime changed (f.e. identical content was
+        reinstalled), byte-code file's header is updated instead.
+        """
+        entry = self.entries.get(fpath)
+        if entry is None or entry[0] != fstat.st_size or not exists(cfpath):
+            return False
+        if entry[1] == fstat.st_mtime:
+            return True
+        try:
+            digest = file_digest(fpath)
+        except (IOError, OSError):
+            return False
+        if digest == entry[2] and \
+           update_timestamp(cfpath, self.magic, fstat.st_mtime):
+            self._set(fpath, (fstat.st_size, fstat.st_mtime, digest))
+            return True
+        return False
+
+    def add(self, fpath, fstat):
+        """Record source file once it's compiled (see save())."""
+        self.pending[fpath] = (fstat.st_size, fstat.st_mtime)
+
+    def discard(self, fpath):
+        """Forget given source file.
+
+        Manifest is not complete anymore if the file was about to be
+        recorded (it failed to compile). Files whose byte-code was removed
+        do not affect the journal, see journal_files().
+        """
+        if self.pending.pop(fpath, None) is not None:
+            self.complete = False
+        if self.entries.pop(fpath, None) is not None:
+            self.changes[fpath] = None
+            self.modified = True
+        if fpath in self.outdated:
+            self.outdated.remove(fpath)
+            self.changes[fpath] = None
+            self.modified = True
+
+    def remove(self):
+        """Remove manifest file."""
+        self.entries = {}
+        self.outdated = set()
+        self.pending = {}
+        self.changes = {}
+        self.modified = False
+        self.exists = False
+        try:
+            remove(self.fpath)
+        except OSError:
+            pass
+
+    def save(self, failed=False):
+        """Record compiled files and write the manifest.
+
+        Manifest file is locked and read again, so changes made by other
+        processes since it was loaded are not lost.
+
+        :param failed: byte compilation failed, do not record new files
+        """
+        if failed:
+            # we don't know which files failed, forget all of them
+            for fpath in self.pending:
+                if self.entries.pop(fpath, None) is not None:
+                    self.changes[fpath] = None
+            if self.pending:
+                self.complete = False
+        else:
+            for fpath, (size, mtime) in self.pending.iteritems():
+                try:
+                    self._set(fpath, (size, mtime, file_digest(fpath)))
+                except (IOError, OSError):
+                    if self.entries.pop(fpath, None) is not None:
+                        self.changes[fpath] = None
+        if self.pending:
+            self.modified = True
+        self.pending = {}
+        if self.outdated.difference(self.entries):
+            # some files compiled by other interpreter were not recompiled,
+            # the manifest cannot be used as a journal anymore
+            self.complete = False
+        self.outdated = set()
+        if not self.modified:
+            return
+
+        tmp_fpath = "%s.%s" % (self.fpath, getpid())
+        try:
+            if not exists(dirname(self.fpath)):
+                makedirs(dirname(self.fpath))
+            with open(self.fpath + '.lock', 'a') as lock:
+                flock(lock, LOCK_EX)  # released when lock file is closed
+                entries, complete = self._merge()
+                with open(tmp_fpath, 'wb') as fp:
+                    marshal.dump((FORMAT, self.magic, complete, entries), fp)
+                rename(tmp_fpath, self.fpath)
+        except (IOError, OSError), e:
+            log.debug('cannot save %s: %s', self.fpath, e)
+        else:
+            self.entries = entries
+            self.complete = self._loaded_complete = complete
+            self.changes = {}
+            self.modified = False
+            self.exists = True
+
+    def _merge(self):
+        """Return entries and complete flag to save.
+
+        Changes made by this process are applied to the manifest file's
+        current content (if it was written by the same interpreter).
+        """
+        data = self._read()
+        if data is None or data[1] != self.magic:
+            return self.entries, self.complete
+        entries = data[3]
+        for fpath, entry in self.changes.iteritems():
+            if entry is None:
+                entries.pop(fpath, None)
+            else:
+                entries[fpath] = entry
+        if self.complete != self._loaded_complete:
+            complete = self.complete  # changed by this process
+        else:
+            complete = data[2]
+        return entries, complete
+
+
+def journal_files(manifest, optimize=False):
+    """Return files that have to be recompiled according to the journal.
+
+    Only complete manifests are used and only if byte-code of all recorded
+    files is still available (it could be removed since the manifest was
+    written).
+
+    :param optimize: check .pyo files instead of .pyc ones
+    :return: None if the site directory has to be scanned
+
+    >>> from tempfile import mkdtemp
+    >>> from os import stat
+    >>> tmp = mkdtemp()
+    >>> fpath = tmp + '/foo.py'
+    >>> open(fpath, 'w').write('x = 1\\n')
+    >>> open(fpath + 'c', 'wb').write('MAG1\\0\\0\\0\\0')
+    >>> manifest = Manifest(tmp + '/manifest.pyc', 'MAG1')
+    >>> journal_files(manifest) is None  # doesn't exist
+    True
+    >>> manifest.add(fpath, stat(fpath))
+    >>> manifest.save()
+    >>> journal_files(manifest) is None  # not complete
+    True
+    >>> manifest.complete = manifest.modified = True
+    >>> manifest.save()
+    >>> journal_files(manifest)
+    []
+    >>> journal_files(Manifest(tmp + '/manifest.pyc', 'MAG2')) == [fpath]
+    True
+    >>> remove(fpath + 'c')
+    >>> journal_files(manifest) is None  # byte-code is missing
+    True
+    >>> from shutil import rmtree; rmtree(tmp)
+    """
+    if manifest is None or not manifest.exists or not manifest.complete:
+        return None
+    suffix = 'o' if optimize else 'c'
+    for fpath in manifest.entries:
+        if not exists(fpath + suffix):
+            log.debug('%s: byte-code of %s is missing, journal cannot be '
+                      'used', manifest.fpath, fpath)
+            return None
+    return sorted(manifest.outdated)
+
+
+def forget(files):
+    """Remove given source files from manifests of their site directories."""
+    manifests = {}
+    for fpath in files:
+        public_dir = PUBLIC_DIR_RE.match(fpath)
+        if not public_dir:
+            continue
+        dname = public_dir.group()
+        if dname not in manifests:
+            manifests[dname] = [Manifest(manifest_path(dname, optimize))
+                                for optimize in (False, True)]
+        for manifest in manifests[dname]:
+            if manifest.exists:
+                manifest.discard(fpath)
+    for items in manifests.itervalues():
+        for manifest in items:
+            if manifest.modified and manifest.exists:
+                manifest.save()
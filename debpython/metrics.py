@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Opt-in counters and timers for pycompile and pyclean.
+
+NullMetrics is used unless a report is requested, so nothing is counted
+or timed by default.
+"""
+
+from __future__ import with_statement
+import json
+import sys
+from contextlib import contextmanager
+from heapq import heappush, heappushpop
+from time import time
+
+
+class Metrics(object):
+    """Collect counters, per-phase wall times and slowest files.
+
+    Time spent in nested phases (f.e. in a timed() generator consumed by
+    another one) is accounted to the innermost phase only.
+
+    >>> metrics = Metrics()
+    >>> list(metrics.timed(metrics.timed(range(3), 'scan'), 'filter'))
+    [0, 1, 2]
+    >>> metrics.incr('compiled', key='2.7')
+    >>> metrics.phases['scan']['items'], metrics.counters
+    (3, {'compiled': {'2.7': 1}})
+    """
+
+    def __init__(self, slowest=10):
+        self.start = time()
+        self.counters = {}
+        self.phases = {}  # {name: {'seconds': float, 'items': int}}
+        self.slowest = []  # heap of (seconds, file name)
+        self.slowest_limit = slowest
+        self._nested = []  # time spent in nested phases, one per level
+
+    def incr(self, name, value=1, key=None):
+        """Increase counter (or its `key` item if given)."""
+        if key is None:
+            self.counters[name] = self.counters.get(name, 0) + value
+        else:
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def add_time(self, phase, seconds, items=0):
+        data = self.phases.setdefault(phase, {'seconds': 0.0, 'items': 0})
+        data['seconds'] += seconds
+        data['items'] += items
+
+    def _enter(self):
+        self._nested.append(0.0)
+        return time()
+
+    def _exit(self, phase, start, items=0):
+        elapsed = time() - start
+        self.add_time(phase, elapsed - self._nested.pop(), items)
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        """Account time spent in the with block to given phase."""
+        start = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, start)
+
+    def timed(self, iterable, phase):
+        """Generate items, account time needed to generate them to phase."""
+        iterator = iter(iterable)
+        while True:
+            start = self._enter()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                self._exit(phase, start)
+                return
+            self._exit(phase, start, 1)
+            yield item
+
+    def file_time(self, fpath, seconds):
+        """Record time needed to process given file."""
+        if len(self.slowest) < self.slowest_limit:
+            heappush(self.slowest, (seconds, fpath))
+        else:
+            heappushpop(self.slowest, (seconds, fpath))
+
+    def as_dict(self):
+        return {'wall_time': time() - self.start,
+                'counters': self.counters,
+                'phases': self.phases,
+                'slowest_files': [{'file': fpath, 'seconds': seconds}
+                                  for seconds, fpath
+                                  in sorted(self.slowest, reverse=True)]}
+
+    def report(self, fpath, **extra):
+        """Write JSON report to given file ('-' means stderr)."""
+        data = self.as_dict()
+        data.update(extra)
+        if fpath == '-':
+            json.dump(data, sys.stderr, indent=1, separators=(',', ': '),
+                      sort_keys=True)
+            sys.stderr.write('\n')
+        else:
+            with open(fpath, 'w') as fp:
+                json.dump(data, fp, indent=1, separators=(',', ': '),
+                          sort_keys=True)
+                fp.write('\n')
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullMetrics(object):
+    """Metrics API that doesn't collect anything.
+
+    >>> metrics = NullMetrics()
+    >>> items = range(3)
+    >>> metrics.timed(items, 'scan') is items
+    True
+    >>> with metrics.phase('wait'):
+    ...     metrics.incr('compiled', key='2.7')
+    """
+    _phase = _NullPhase()
+
+    def incr(self, name, value=1, key=None):
+        pass
+
+    def add_time(self, phase, seconds, items=0):
+        pass
+
+    def phase(self, name):
+        return self._phase
+
+    def timed(self, iterable, phase):
+        return iterable
+
+    def file_time(self, fpath, seconds):
+        pass
@@ -21,14 +21,19 @@
 
 from __future__ import with_statement
 import logging
-from os import environ, listdir, remove, rmdir
+import marshal
+import os
+from os import environ, getpid, listdir, makedirs, remove, rename, rmdir, \
+    stat
 from os.path import dirname, exists, join, getsize, split
-from subprocess import Popen, PIPE
 
-from debpython.tools import memoize, sitedir, PUBLIC_DIR_RE
+from debpython.dpkg import init_owners
+from debpython.tools import memoize, sitedir, CACHE_DIR, PUBLIC_DIR_RE
 
 log = logging.getLogger(__name__)
 
+INDEX_FORMAT = 1  # bump it if format of index_path() file changes
+
 
 def parse(fpaths, other=None):
     """Parse namespace_packages.txt files."""
@@ -41,79 +46,238 @@ def parse(fpaths, other=None):
     return result
 
 
+class Namespaces(object):
+    """Set of namespace packages (f.e. "foo/bar") stored in a trie.
+
+    >>> ns = Namespaces(['foo', 'foo/bar', 'baz'])
+    >>> ns.find('foo/bar/qux'), ns.find('foo/barx'), ns.find('')
+    (['foo', 'foo/bar'], ['foo'], [])
+    >>> 'foo/bar' in ns, 'foo/b' in ns, len(ns)
+    (True, False, 3)
+    >>> ns.overlaps('foo/bar/qux/'), ns.overlaps('foo/'), ns.overlaps('qux/')
+    (True, True, False)
+    """
+
+    def __init__(self, namespaces=(), trie=None):
+        self.trie = {} if trie is None else trie
+        for ns in namespaces:
+            self.add(ns)
+
+    def add(self, ns):
+        node = self.trie
+        for part in ns.split('/'):
+            node = node.setdefault(part, {})
+        node[None] = True  # None is never a directory name
+
+    def _walk(self, dpath):
+        """Generate (directory, trie node) pairs along given path."""
+        node = self.trie
+        parts = [i for i in dpath.split('/') if i]
+        for i, part in enumerate(parts):
+            node = node.get(part)
+            if node is None:
+                return
+            yield '/'.join(parts[:i + 1]), node
+
+    def find(self, dpath):
+        """Return namespaces given directory is (or is located in).
+
+        :param dpath: directory relative to the site directory
+        """
+        return [ns for ns, node in self._walk(dpath) if None in node]
+
+    def overlaps(self, dpath):
+        """Check if there is a namespace in, above or at given directory."""
+        node = self.trie
+        for part in (i for i in dpath.split('/') if i):
+            node = node.get(part)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return len(node) > 0
+
+    def __contains__(self, ns):
+        return ns in self.find(ns)
+
+    def __iter__(self):
+        stack = [('', self.trie)]
+        while stack:
+            prefix, node = stack.pop()
+            for part, child in node.iteritems():
+                if part is None:
+                    yield prefix.rstrip('/')
+                else:
+                    stack.append((prefix + part + '/', child))
+
+    def __len__(self):
+        return sum(1 for i in self)
+
+
+def index_path():
+    """Return path to the index of all namespaces (DESTDIR is used in tests).
+
+    >>> index_path().endswith('/var/cache/python/namespaces')
+    True
+    """
+    return "%s%s/namespaces" % (environ.get('DESTDIR', ''), CACHE_DIR)
+
+
+def load_index(nsdir):
+    """Return trie of namespaces declared by all files in given directory.
+
+    The trie is kept in index_path() file, it's used as is if the directory
+    was not modified (dpkg renames files it installs) and only new or
+    modified files are parsed otherwise.
+    """
+    try:
+        dir_mtime = stat(nsdir).st_mtime
+    except OSError:
+        return {}
+    fpath = index_path()
+    cached = {}
+    try:
+        with open(fpath, 'rb') as fp:
+            data = marshal.load(fp)
+        if data[:2] == (INDEX_FORMAT, nsdir):
+            if data[2] == dir_mtime:
+                return data[4]
+            cached = data[3]
+    except (IOError, OSError, EOFError, ValueError, TypeError, IndexError):
+        pass
+
+    files = {}  # {file name: (mtime, namespaces)}
+    namespaces = Namespaces()
+    for fn in listdir(nsdir):
+        try:
+            mtime = stat(join(nsdir, fn)).st_mtime
+        except OSError:
+            continue
+        entry = cached.get(fn)
+        if entry is None or entry[0] != mtime:
+            log.debug('updating namespace index with %s', fn)
+            items = parse([join(nsdir, fn)])
+            entry = (mtime, sorted(i.replace('.', '/') for i in items))
+        files[fn] = entry
+        for ns in entry[1]:
+            namespaces.add(ns)
+
+    tmp_fpath = "%s.%s" % (fpath, getpid())
+    try:
+        if not exists(dirname(fpath)):
+            makedirs(dirname(fpath))
+        with open(tmp_fpath, 'wb') as fp:
+            marshal.dump((INDEX_FORMAT, nsdir, dir_mtime, files,
+                          namespaces.trie), fp)
+        rename(tmp_fpath, fpath)
+    except (IOError, OSError), e:
+        log.debug('cannot save %s: %s', fpath, e)
+    return namespaces.trie
+
+
 @memoize
 def load(package=None):
-    """Return a set of namespaces to regenerate/clean.
+    """Return Namespaces to regenerate/clean.
 
     :param package: limit namespaces to the ones needed by given package
+        (or a tuple of packages)
     """
-    fpaths = None
     # DESTDIR is used in tests
     nsdir = "%s/usr/share/python/ns/" % environ.get('DESTDIR', '')
-    if package:
-        # only one package is processed, no need to load all files
-        fpath = join(nsdir, package)
-        if exists(fpath):
-            fpaths = [fpath]
-    else:
-        # load all files
-        if exists(nsdir):
-            fpaths = [join(nsdir, i) for i in listdir(nsdir)]
-
-    if fpaths:
-        result = set(i.replace('.', '/') for i in parse(fpaths))
-    else:
-        result = set()
+    if not package:
+        return Namespaces(trie=load_index(nsdir))
+
+    # only requested packages are processed, no need to load all files
+    if isinstance(package, basestring):
+        package = (package,)
+    fpaths = [join(nsdir, i) for i in package if exists(join(nsdir, i))]
+    return Namespaces(i.replace('.', '/') for i in parse(fpaths))
+
+
+def create_files(fpaths, fsync=False):
+    """Create missing (empty) files, one directory at a time.
+
+    :param fsync: flush each modified directory to disk (once)
+    :return: list of available files, sorted by directory
+    """
+    result = []
+    directories = {}
+    for fpath in fpaths:
+        dname, fname = split(fpath)
+        directories.setdefault(dname, []).append(fname)
+    for dname, fnames in sorted(directories.iteritems()):
+        modified = False
+        for fname in sorted(fnames):
+            fpath = join(dname, fname)
+            if not exists(fpath):
+                try:
+                    open(fpath, 'a').close()
+                except Exception:
+                    log.error('cannot create %s', fpath)
+                    continue
+                modified = True
+            result.append(fpath)
+        if fsync and modified:
+            try:
+                fd = os.open(dname, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError, e:
+                log.debug('cannot sync %s: %s', dname, e)
     return result
 
 
-def add_namespace_files(files, package=None, action=None):
-    """Add __init__.py files to given generator."""
+def add_namespace_files(files, package=None, action=None, dry_run=False,
+                        fsync=False):
+    """Add __init__.py files to given generator.
+
+    Namespace packages' __init__.py files are generated once all given
+    files are processed (and created in one batch if action is True).
+
+    :param dry_run: do not remove __init__.py files (if action is False),
+        just generate their names
+    :param fsync: sync directories with created files (see create_files())
+    """
     if action is not None:
         namespaces = load(package)
         already_processed = set()
-        removal_candidates = set()
+        ns_files = set()
+        init_files = set()  # the ones already in files
     for fn in files:
         yield fn
         if action is None:
             continue
+        if fn.endswith('/__init__.py'):
+            init_files.add(fn)
         dpath = dirname(fn)
-        if dpath not in already_processed:
-            already_processed.add(dpath)
-            m = PUBLIC_DIR_RE.match(dpath)
-            if m:
-                public_dir = m.group()
-                while dpath != public_dir:
-                    ns_dir = dpath[len(public_dir) + 1:]
-                    if ns_dir in namespaces:
-                        fpath = join(dpath, '__init__.py')
-                        if action is True:
-                            try:
-                                open(fpath, 'a').close()
-                            except Exception:
-                                log.error('cannot create %s', fpath)
-                            else:
-                                yield fpath
-                        else:  # action is False
-                            # postpone it due to dpkg -S call
-                            removal_candidates.add(fpath)
-                    already_processed.add(dpath)
-                    dpath = split(dpath)[0]
-
-    # now deal with to-be-removed namespace candidates (dpkg -S is expensive)
-    # dpgk -S is used just to be safe (in case some other package is providing
+        if dpath in already_processed:
+            continue
+        already_processed.add(dpath)
+        m = PUBLIC_DIR_RE.match(dpath)
+        if not m:
+            continue
+        public_dir = m.group()
+        for ns_dir in namespaces.find(dpath[len(public_dir) + 1:]):
+            ns_files.add(join(public_dir, ns_dir, '__init__.py'))
+
+    if action is True and ns_files:
+        for fpath in create_files(ns_files, fsync):
+            if fpath not in init_files:
+                yield fpath
+
+    # now deal with to-be-removed namespace candidates, dpkg's database is
+    # checked just to be safe (in case some other package is providing
     # __init__.py file although it's in /usr/share/python/ns dir)
-    if action is False and removal_candidates:
-        process = Popen("/usr/bin/dpkg -S %s 2>/dev/null" % \
-                        ' '.join(removal_candidates), shell=True, stdout=PIPE)
-        # FIXME: len(search_string) > 131072
-        stdout, stderr = process.communicate()
-        for line in stdout.splitlines():
-            ns = line.split(': ', 1)[1]
-            if ns in removal_candidates:
-                removal_candidates.remove(ns)
+    if action is False and ns_files:
+        owners = init_owners()
+        removal_candidates = sorted(i for i in ns_files if i not in owners)
 
         for fpath in removal_candidates:
+            if dry_run:
+                yield fpath
+                continue
             try:
                 remove(fpath)
             except (IOError, OSError), e:
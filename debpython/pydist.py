@@ -0,0 +1,482 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Python distribution name to Debian dependency mapping.
+
+dist_fallback (distribution name, space, Debian dependency in each line)
+is compiled into an index that can be memory mapped: a header, a sorted
+table of offsets and NUL separated records (normalized distribution
+name, dependency). Lookups do not have to read the whole file.
+
+PyDist files (see README.PyDist) installed in /usr/share/python/dist/
+take precedence over dist_fallback, see load() and PyDist.resolve().
+"""
+
+from __future__ import with_statement
+import logging
+import mmap
+import re
+import struct
+from os import environ, getpid, listdir, remove, rename
+from os.path import exists, isdir, join
+from string import maketrans
+
+from debpython.tools import memoize
+from debpython.version import compile_vrange, getver
+
+log = logging.getLogger(__name__)
+
+DIST_DIR = '/usr/share/python/dist'
+FALLBACK = '/usr/share/python/dist_fallback'
+INDEX_MAGIC = 'DPyF'
+INDEX_FORMAT = 1  # bump it if index's format changes
+_HEADER = struct.Struct('<4sII')  # magic, format, number of entries
+_OFFSET = struct.Struct('<I')
+SAFE_NAME_RE = re.compile(r'[^A-Za-z0-9.]+')
+PYDIST_RE = re.compile(r"""
+    (?P<name>[A-Za-z][A-Za-z0-9_.\-]*)            # distribution name
+    \s*
+    (?P<vrange>(?:-?\d\.\d+(?:-(?:\d\.\d+)?)?)?)  # Python version range
+    \s*
+    (?P<dependency>(?:[a-z][^;]*)?)               # Debian dependency
+    (?:  # optional upstream version -> Debian version translator
+        ;\s*
+        (?P<standard>PEP386)?                     # PEP-386 mode
+        \s*
+        (?P<rules>(?:s|tr|y)\S.*)?                # translator rules
+    )?
+    $""", re.VERBOSE)
+REQUIRES_RE = re.compile(r"""
+    (?P<name>[A-Za-z0-9_][^!<>=\s\[;]*)     # distribution name
+    \s*
+    (?:\[[^\]]*\])?                         # extras (ignored)
+    \s*
+    (?:  # optional minimum/maximum version
+        (?P<operator><=?|>=?|==|!=)
+        \s*
+        (?P<version>[\w.\-]+)
+    )?
+    """, re.VERBOSE)
+PRE_VER_RE = re.compile(r'[-.]?(alpha|beta|rc|dev|a|b|c)')
+GROUP_RE = re.compile(r'\$(\d+)')
+DEB_OPERATORS = {'<': '<<', '>': '>>'}
+
+
+def safe_name(name):
+    """Emulate distribute's safe_name (lower cased).
+
+    >>> safe_name('Foo_Bar-baz')
+    'foo_bar_baz'
+    """
+    return SAFE_NAME_RE.sub('_', name).lower()
+
+
+def sensible_pname(egg_name):
+    """Guess Debian package name from Egg name.
+
+    >>> sensible_pname('Jinja2')
+    'python-jinja2'
+    >>> sensible_pname('python-Foo_bar')
+    'python-foo-bar'
+    """
+    egg_name = safe_name(egg_name).replace('_', '-')
+    if egg_name.startswith('python-'):
+        egg_name = egg_name[7:]
+    return "python-%s" % egg_name
+
+
+def read_fallback(fpath):
+    """Generate (distribution name, dependency) pairs from dist_fallback."""
+    with open(fpath) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, _, dependency = line.partition(' ')
+            yield name, dependency.strip()
+
+
+def index_path(fpath=FALLBACK):
+    """Return path to the index of given dist_fallback file."""
+    return fpath + '.idx'
+
+
+def write_index(items, fpath):
+    """Write index of (distribution name, dependency) pairs.
+
+    First entry wins if more than one distribution name is normalized
+    to the same key (i.e. order in dist_fallback is respected).
+    """
+    entries = {}
+    for name, dependency in items:
+        key = safe_name(name)
+        if '\0' in key or '\0' in dependency:
+            raise ValueError("invalid entry: %r" % name)
+        entries.setdefault(key, dependency)
+    keys = sorted(entries)
+
+    offsets = []
+    records = []
+    pos = _HEADER.size + _OFFSET.size * len(keys)
+    for key in keys:
+        record = "%s\0%s\0" % (key, entries[key])
+        offsets.append(pos)
+        records.append(record)
+        pos += len(record)
+
+    tmp_fpath = "%s.%s" % (fpath, getpid())
+    try:
+        with open(tmp_fpath, 'wb') as fp:
+            fp.write(_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, len(keys)))
+            fp.write(struct.pack('<%dI' % len(offsets), *offsets))
+            fp.writelines(records)
+        rename(tmp_fpath, fpath)
+    except:
+        try:
+            remove(tmp_fpath)
+        except OSError:
+            pass
+        raise
+    return len(keys)
+
+
+class FallbackIndex(object):
+    """Memory mapped dist_fallback index (see write_index()).
+
+    :raise ValueError: if given file is not a valid index
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        with open(fpath, 'rb') as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, format_, self._size = _HEADER.unpack_from(self._map)
+        except struct.error:
+            magic = format_ = None
+        if magic != INDEX_MAGIC or format_ != INDEX_FORMAT or \
+           len(self._map) < _HEADER.size + _OFFSET.size * self._size:
+            self._map.close()
+            raise ValueError("%s: not a dist_fallback index" % fpath)
+
+    def __len__(self):
+        return self._size
+
+    def _record(self, i):
+        """Return (key, end of key) of i-th entry."""
+        start = _OFFSET.unpack_from(self._map,
+                                    _HEADER.size + _OFFSET.size * i)[0]
+        end = self._map.find('\0', start)
+        return self._map[start:end], end
+
+    def _bisect(self, key, lo=0):
+        """Return position of the first entry not lower than given key."""
+        hi = self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _dependency(self, i, key):
+        """Return dependency of i-th entry if its key matches."""
+        if i >= self._size:
+            return None
+        found, end = self._record(i)
+        if found != key:
+            return None
+        return self._map[end + 1:self._map.find('\0', end + 1)]
+
+    def get(self, name, default=None):
+        """Return Debian dependency of given distribution name."""
+        key = safe_name(name)
+        result = self._dependency(self._bisect(key), key)
+        return default if result is None else result
+
+    def lookup(self, names):
+        """Resolve a batch of distribution names.
+
+        Keys are looked up in sorted order so that each search starts where
+        the previous one ended.
+
+        :return: {distribution name: dependency} for names found in the index
+        """
+        keys = {}
+        for name in names:
+            keys.setdefault(safe_name(name), []).append(name)
+        result = {}
+        pos = 0
+        for key in sorted(keys):
+            pos = self._bisect(key, pos)
+            dependency = self._dependency(pos, key)
+            if dependency is not None:
+                for name in keys[key]:
+                    result[name] = dependency
+        return result
+
+    def __iter__(self):
+        """Generate (normalized distribution name, dependency) pairs."""
+        for i in xrange(self._size):
+            key, end = self._record(i)
+            yield key, self._map[end + 1:self._map.find('\0', end + 1)]
+
+    def close(self):
+        self._map.close()
+
+
+@memoize
+def fallback_index(fpath=FALLBACK):
+    """Return index of given dist_fallback file or None if not available."""
+    # DESTDIR is used in tests
+    fpath = environ.get('DESTDIR', '') + index_path(fpath)
+    try:
+        return FallbackIndex(fpath)
+    except (IOError, OSError, ValueError), e:
+        log.debug('cannot use %s: %s', fpath, e)
+        return None
+
+
+def _sed_rule(rule):
+    """Return function that applies given s/// or tr/// (y///) rule."""
+    if rule.startswith(('tr', 'y')):
+        # Note: no support for escaped separator in the pattern
+        pos = 1 if rule.startswith('y') else 2
+        parts = rule[pos + 1:].split(rule[pos])
+        table = maketrans(parts[0], parts[1])
+        return lambda version: version.translate(table)
+    # uscan supports: g, u and x flags
+    parts = rule[2:].split(rule[1])
+    flags = parts[2] if len(parts) > 2 else ''
+    pattern = re.compile(parts[0], re.I if 'i' in flags else 0)
+    repl = GROUP_RE.sub(r'\\g<\1>', parts[1])  # Perl's $1 -> \g<1>
+    count = 0 if 'g' in flags else 1
+    return lambda version: pattern.sub(repl, version, count)
+
+
+@memoize
+def compile_rules(rules, standard=None):
+    """Return function that translates upstream version to Debian one.
+
+    Rules are compiled once, identical rules share the same function
+    (see _compile_rules()).
+    """
+    return _compile_rules(rules, standard)
+
+
+def _compile_rules(rules, standard=None):
+    """Return function that translates upstream version to Debian one.
+
+    >>> _compile_rules('s/c//gi')('1.C2betac')
+    '1.2beta'
+    >>> _compile_rules('s/^/1:/ s/-foo//g s:([A-Z]):+$1:', 'PEP386')(
+    ...     '5-fooa1.2beta3-fooD')
+    '1:5~a1.2~beta3+D'
+    >>> _compile_rules('tr/xy/ab/ y,z,Z,')('x.y.x.z')
+    'a.b.a.Z'
+
+    :param rules: space separated rules
+    :param standard: 'PEP386' or None
+    """
+    functions = []
+    for rule in (rules or '').split():
+        try:
+            if not rule.startswith(('s', 'tr', 'y')):
+                raise ValueError('unknown rule')
+            functions.append(_sed_rule(rule))
+        except (ValueError, IndexError, re.error), e:
+            log.warning('rule ignored: %s (%s)', rule, e)
+
+    def translate(version):
+        for function in functions:
+            version = function(version)
+        if standard == 'PEP386':
+            version = PRE_VER_RE.sub(r'~\g<1>', version)
+        return version
+    return translate
+
+
+def read_pydist(fpath):
+    """Generate (normalized name, entry) pairs from PyDist file.
+
+    Entries are (version range or None, dependency, translator or None)
+    tuples, invalid lines are skipped.
+    """
+    with open(fpath) as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = PYDIST_RE.match(line)
+            if not match:
+                log.warning('invalid pydist line: %s (in %s)', line, fpath)
+                continue
+            dist = match.groupdict()
+            vrange = compile_vrange(dist['vrange']) if dist['vrange'] \
+                else None
+            if dist['standard'] or dist['rules']:
+                translator = compile_rules(dist['rules'] or '',
+                                           dist['standard'])
+            else:
+                translator = None
+            yield safe_name(dist['name']), \
+                (vrange, dist['dependency'].strip(), translator)
+
+
+def parse_requires(lines):
+    """Return requirements listed in requires.txt (extras are skipped).
+
+    >>> parse_requires(['Foo>=1.0', '', '# comment', 'bar', '[test]', 'baz'])
+    ['Foo>=1.0', 'bar']
+    """
+    result = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('['):
+            break  # extras
+        result.append(line)
+    return result
+
+
+class PyDist(object):
+    """Debian dependencies of Python distributions (see load()).
+
+    >>> translator = compile_rules('s/^/1:/', 'PEP386')
+    >>> pydist = PyDist({'foo': [(compile_vrange('-2.7'), 'python-oldfoo',
+    ...                           None),
+    ...                          (None, 'python-foo', translator)],
+    ...                  'bar': [(None, '', None)]},
+    ...                 {'baz': 'python-baz (>= 2)'})
+    >>> pydist.resolve(['Foo>=2.0b1', 'bar', 'Baz>1', 'Unknown'], '2.7')
+    (['python-foo (>= 1:2.0~b1)', 'python-baz (>= 2)'], ['Unknown'])
+    >>> pydist.resolve(['foo>2.0', 'foo'], '2.6')
+    (['python-oldfoo'], [])
+
+    dist_fallback is used if no entry matches:
+
+    >>> pydist = PyDist({'foo': [(compile_vrange('-2.7'), 'python-oldfoo',
+    ...                           None)]},
+    ...                 {'foo': 'python-foo'})
+    >>> pydist.resolve(['foo'], '2.7')
+    (['python-foo'], [])
+
+    :param entries: {normalized name: [(version range, dependency,
+        translator), ...]}, first matching entry wins
+    :param fallback: FallbackIndex or {normalized name: dependency} dict,
+        last resort for all distributions
+    """
+
+    def __init__(self, entries, fallback=None):
+        self.entries = entries
+        self.fallback = fallback if fallback is not None else {}
+        self.checked = set()  # names already looked up in fallback
+        self.cache = {}  # {(name, operator, version, Python version): dep}
+
+    def _fallback(self, names):
+        """Add fallback entries of given distributions as last candidates."""
+        names = [i for i in names if i not in self.checked]
+        if not names:
+            return
+        self.checked.update(names)
+        if isinstance(self.fallback, dict):
+            found = dict((i, self.fallback[i]) for i in names
+                         if i in self.fallback)
+        else:
+            found = self.fallback.lookup(names)
+        for name in names:
+            entries = self.entries.setdefault(name, [])
+            if name in found:
+                entries.append((None, found[name], None))
+
+    def _resolve(self, name, operator, version, pyver):
+        for vrange, dependency, translator in self.entries[name]:
+            if vrange is not None and pyver and pyver not in vrange:
+                continue
+            if not dependency:
+                return ''  # this requirement should be ignored
+            if dependency.endswith(')'):
+                # version is hardcoded in Debian dependency
+                return dependency
+            if version and translator and operator not in ('==', '!='):
+                return "%s (%s %s)" % (dependency,
+                                       DEB_OPERATORS.get(operator, operator),
+                                       translator(version))
+            return dependency
+
+    def resolve(self, requirements, version=None):
+        """Translate requirements to Debian dependencies.
+
+        :param requirements: requires.txt's lines (see parse_requires())
+        :param version: Python version, entries with version range that
+            doesn't include it are skipped (all entries are used if None)
+        :return: (list of Debian dependencies, list of distribution names
+            that cannot be resolved)
+        :raise ValueError: if a requirement is not valid
+        """
+        pyver = getver(version) if isinstance(version, basestring) \
+            else version
+        keys = []
+        for req in requirements:
+            match = REQUIRES_RE.match(req)
+            if not match:
+                raise ValueError("requirement is not valid: %s" % req)
+            key = (safe_name(match.group('name')), match.group('operator'),
+                   match.group('version'), pyver)
+            keys.append((match.group('name'), key))
+        self._fallback(set(key[0] for _, key in keys
+                           if key not in self.cache))
+
+        dependencies = []
+        missing = []
+        for name, key in keys:
+            try:
+                result = self.cache[key]
+            except KeyError:
+                result = self.cache[key] = self._resolve(*key)
+            if result is None:
+                if name not in missing:
+                    missing.append(name)
+            elif result and result not in dependencies:
+                dependencies.append(result)
+        return dependencies, missing
+
+
+@memoize
+def load(dname=DIST_DIR, fallback=FALLBACK):
+    """Load PyDist files and dist_fallback (its index if available)."""
+    # DESTDIR is used in tests
+    destdir = environ.get('DESTDIR', '')
+    entries = {}
+    if isdir(destdir + dname):
+        for fn in sorted(listdir(destdir + dname)):
+            for name, entry in read_pydist(join(destdir + dname, fn)):
+                entries.setdefault(name, []).append(entry)
+
+    index = fallback_index(fallback)
+    if index is None:
+        index = {}
+        if exists(destdir + fallback):
+            for name, dependency in read_fallback(destdir + fallback):
+                index.setdefault(safe_name(name), dependency)
+    return PyDist(entries, index)
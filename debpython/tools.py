@@ -20,9 +20,12 @@
 # THE SOFTWARE.
 
 import re
+from collections import OrderedDict
 from cPickle import dumps
+from functools import update_wrapper
 
 PUBLIC_DIR_RE = re.compile(r'.*?/usr/lib/python(\d.\d+)/(site|dist)-packages')
+CACHE_DIR = '/var/cache/python'
 
 
 def sitedir(version, package=None, gdb=False):
@@ -50,12 +53,74 @@ def sitedir(version, package=None, gdb=False):
 
 
 class memoize(object):
-    def __init__(self, func):
+    """Cache results of decorated function.
+
+    Arguments are used as the key if they're hashable (pickled otherwise).
+    Use @memoize(maxsize=N) to keep N most recently used results only.
+
+    >>> @memoize(maxsize=2)
+    ... def double(value):
+    ...     return value * 2
+    >>> double(1), double([2]), double(1), double(value=3)
+    (2, [2, 2], 2, 6)
+    >>> double.hits, double.misses, len(double.cache)
+    (1, 3, 2)
+    >>> double.cache_clear()
+    >>> double.hits, double.misses, len(double.cache)
+    (0, 0, 0)
+
+    Keyword arguments do not collide with positional ones:
+
+    >>> @memoize
+    ... def echo(*args, **kwargs):
+    ...     return args, kwargs
+    >>> echo(1, x=2)
+    ((1,), {'x': 2})
+    >>> echo((1,), (('x', 2),))
+    (((1,), (('x', 2),)), {})
+    """
+
+    _kwd_mark = object()  # separates positional and keyword arguments
+
+    def __init__(self, func=None, maxsize=None):
+        self.func = None
+        self.maxsize = maxsize
+        self.cache = {} if maxsize is None else OrderedDict()
+        self.hits = self.misses = 0
+        if func is not None:
+            self._wrap(func)
+
+    def _wrap(self, func):
         self.func = func
-        self.cache = {}
+        update_wrapper(self, func)
+        return self
 
     def __call__(self, *args, **kwargs):
-        key = dumps((args, kwargs))
-        if key not in self.cache:
-            self.cache[key] = self.func(*args, **kwargs)
-        return self.cache[key]
+        if self.func is None:  # @memoize(maxsize=N)
+            return self._wrap(args[0])
+        if kwargs:
+            key = args + (self._kwd_mark,) + tuple(sorted(kwargs.iteritems()))
+        else:
+            key = args
+        try:
+            result = self.cache[key]
+        except TypeError:  # unhashable arguments
+            key = (self._kwd_mark, dumps((args, kwargs)))
+            result = self.cache.get(key, self)
+        except KeyError:
+            result = self
+        if result is self:
+            self.misses += 1
+            result = self.cache[key] = self.func(*args, **kwargs)
+            if self.maxsize is not None and len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        else:
+            self.hits += 1
+            if self.maxsize is not None:  # mark it as recently used
+                self.cache[key] = self.cache.pop(key)
+        return result
+
+    def cache_clear(self):
+        """Remove all cached results and reset statistics."""
+        self.cache.clear()
+        self.hits = self.misses = 0
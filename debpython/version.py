@@ -21,11 +21,13 @@
 
 import logging
 import re
-from ConfigParser import SafeConfigParser
 from os import environ
 from os.path import exists
 from types import GeneratorType
 
+from debpython import defaults
+from debpython.tools import memoize
+
 # will be overriden via debian_defaults file few lines later
 SUPPORTED = [(2, 7),]
 DEFAULT = (2, 7)
@@ -35,18 +37,14 @@ RANGE_RE = re.compile(RANGE_PATTERN)
 
 log = logging.getLogger(__name__)
 
-# try to read debian_defaults and get a list of supported Python versions and
-# the default one from there
+# try to read debian_defaults (see debpython.defaults) and get a list of
+# supported Python versions and the default one from there
 _supported = environ.get('DEBPYTHON_SUPPORTED')
 _default = environ.get('DEBPYTHON_DEFAULT')
-if not _supported or not _default:
-    _config = SafeConfigParser()
-    _config.read('/usr/share/python/debian_defaults')
-    if not _default:
-        _default = _config.get('DEFAULT', 'default-version')[6:]
-    if not _supported:
-        _supported = _config.get('DEFAULT', 'supported-versions')\
-                     .replace('python', '')
+if not _default:
+    _default = defaults.get('default-version', '')[6:]
+if not _supported:
+    _supported = defaults.get('supported-versions', '').replace('python', '')
 try:
     DEFAULT = tuple(int(i) for i in _default.split('.'))
 except Exception:
@@ -57,6 +55,90 @@ try:
 except Exception:
     log.exception('cannot read debian_defaults')
 
+# versions VersionRange keeps precomputed membership of
+KNOWN = tuple(sorted(set((2, i) for i in xrange(8)) | set(SUPPORTED) |
+                     set([DEFAULT])))
+_BITS = dict((version, 1 << i) for i, version in enumerate(KNOWN))
+
+
+class VersionRange(object):
+    """Predicate that checks if version belongs to given range.
+
+    Maximum version is not included unless `inclusive` is set or it's
+    equal to the minimum one (see parse_vrange() and compile_vrange()).
+    Membership of KNOWN versions is checked with a bitmask.
+
+    >>> vr = VersionRange((2, 6), (3, 0))
+    >>> (2, 6) in vr, '2.7' in vr, (3, 0) in vr, (2, 5) in vr
+    (True, True, False, False)
+    >>> (3, 0) in VersionRange((2, 6), (3, 0), inclusive=True)
+    True
+    >>> sorted(VersionRange((2, 5), (2, 5)).filter(['2.5', (2, 6)]))
+    ['2.5']
+    >>> (2, 12) in VersionRange(None, (2, 6)), (2, 12) in VersionRange((2, 6))
+    (False, True)
+    >>> '2.6' in compile_vrange('2.4-2.6'), '2.6' in compile_vrange('-2.6')
+    (False, False)
+    >>> '2.6' in compile_vrange('2.4-2.6', inclusive=True)
+    True
+    """
+
+    def __init__(self, minv=None, maxv=None, inclusive=False):
+        self.minv = minv
+        self.maxv = maxv
+        self.inclusive = inclusive or (minv is not None and minv == maxv)
+        self.mask = 0
+        for version, bit in _BITS.iteritems():
+            if self._match(version):
+                self.mask |= bit
+
+    def _match(self, version):
+        if self.minv is not None and version < self.minv:
+            return False
+        if self.maxv is not None:
+            if version > self.maxv:
+                return False
+            if version == self.maxv and not self.inclusive:
+                return False
+        return True
+
+    def __contains__(self, version):
+        if isinstance(version, basestring):
+            version = getver(version)
+        bit = _BITS.get(version)
+        if bit is not None:
+            return bool(self.mask & bit)
+        return self._match(version)
+
+    def __eq__(self, other):
+        return isinstance(other, VersionRange) and \
+            (self.minv, self.maxv, self.inclusive) == \
+            (other.minv, other.maxv, other.inclusive)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "VersionRange(%r, %r%s)" % (
+            self.minv, self.maxv, ', inclusive=True' if self.inclusive else '')
+
+    def filter(self, versions):
+        """Return a set of given versions that belong to the range."""
+        return set(v for v in versions if v in self)
+
+
+@memoize
+def compile_vrange(value, inclusive=False):
+    """Return VersionRange for given range (see parse_vrange()).
+
+    Examples are in VersionRange's docstring (doctest doesn't see
+    memoized functions).
+
+    :param inclusive: maximum version is included (debian/pyversions' style)
+    """
+    minv, maxv = parse_vrange(value)
+    return VersionRange(minv, maxv, inclusive)
+
 
 def get_requested_versions(vrange=None, available=None):
     """Return a set of requested and supported Python versions.
@@ -74,19 +156,18 @@ def get_requested_versions(vrange=None, available=None):
     True
     >>> get_requested_versions([(5, 0), None])
     set([])
+    >>> sorted(get_requested_versions(compile_vrange('-3.0')))
+    [(2, 7)]
     """
     if isinstance(vrange, basestring):
-        vrange = parse_vrange(vrange)
+        vrange = compile_vrange(vrange)
+    elif vrange and not isinstance(vrange, VersionRange):
+        vrange = VersionRange(*vrange)
 
-    if not vrange or list(vrange) == [None, None]:
+    if not vrange:
         versions = set(SUPPORTED)
     else:
-        minv = (0, 0) if vrange[0] is None else vrange[0]
-        maxv = (99, 99) if vrange[1] is None else vrange[1]
-        if minv == maxv:
-            versions = set((minv,) if minv in SUPPORTED else tuple())
-        else:
-            versions = set(v for v in SUPPORTED if minv <= v < maxv)
+        versions = vrange.filter(SUPPORTED)
 
     if available:
         versions = set(v for v in versions
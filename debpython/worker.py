@@ -0,0 +1,183 @@
+# -*- coding: UTF-8 -*-
+# Copyright © 2019 Piotr Ożarowski <piotr@debian.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Byte compilation worker and the reader of its results.
+
+pycompile starts this file with every interpreter it compiles for. File
+names are read from stdin (one per line, escaped with string_escape codec)
+and a record is written to stdout as soon as each of them is compiled::
+
+    ok<TAB>seconds<TAB>escaped file name
+    error<TAB>seconds<TAB>escaped file name<TAB>escaped error message
+
+The compile server (see debpython.daemon) sends the same records followed
+by ``exit<TAB>status``.
+
+This file is executed by the interpreter it compiles for, so it has to use
+the standard library only.
+"""
+
+import errno
+import os
+import sys
+from select import select, error as select_error
+from time import time
+
+
+def format_record(status, filename, seconds, message=None):
+    r"""Return a line describing result of compiling given file.
+
+    >>> format_record('error', 'foo.py', 0.5, 'line 1\nline 2')
+    'error\t0.500000\tfoo.py\tline 1\\nline 2\n'
+    >>> format_record('ok', 'a\tb.py', 0.5)
+    'ok\t0.500000\ta\\tb.py\n'
+    """
+    line = "%s\t%f\t%s" % (status, seconds, filename.encode('string_escape'))
+    if message:
+        line += "\t%s" % message.encode('string_escape')
+    return line + '\n'
+
+
+def parse_record(line):
+    r"""Return (status, file name, seconds, message) tuple.
+
+    >>> parse_record('error\t0.500000\tfoo.py\tline 1\\nline 2')
+    ('error', 'foo.py', 0.5, 'line 1\nline 2')
+    >>> parse_record('exit\t1')
+    ('exit', None, None, '1')
+    >>> parse_record(format_record('error', 'a\tb\n.py', 1, 'x\ty'))
+    ('error', 'a\tb\n.py', 1.0, 'x\ty')
+    """
+    fields = line.rstrip('\n').split('\t', 3)
+    if fields[0] == 'exit':
+        return 'exit', None, None, fields[1]
+    message = fields[3].decode('string_escape') if len(fields) > 3 else None
+    return fields[0], fields[2].decode('string_escape'), float(fields[1]), \
+        message
+
+
+def compile_files(infile, outfile):
+    """Compile files listed in infile, report each of them to outfile.
+
+    :return: 0 if all files were compiled, 1 otherwise
+    """
+    import py_compile
+    rv = 0
+    # iteration over a file reads ahead, do not wait for more names
+    for line in iter(infile.readline, ''):
+        filename = line.rstrip('\n').decode('string_escape')
+        if not filename:
+            continue
+        start = time()
+        status, message = 'ok', None
+        try:
+            py_compile.compile(filename, doraise=True)
+        except py_compile.PyCompileError, e:
+            status, message = 'error', e.msg
+        except (IOError, OSError), e:
+            status, message = 'error', str(e)
+        if status != 'ok':
+            rv = 1
+        outfile.write(format_record(status, filename, time() - start,
+                                    message))
+        outfile.flush()
+    return rv
+
+
+class Collector(object):
+    """Read records streamed by workers without blocking on any of them.
+
+    Workers are Popen-like objects with `stdin` and `stdout` attributes,
+    `callback` is called with the worker and parse_record()'s result for
+    each file. Exit status sent by the compile server is stored in worker's
+    `returncode`.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.streams = {}  # {file descriptor: [worker, incomplete line]}
+
+    def add(self, worker):
+        self.streams[worker.stdout.fileno()] = [worker, '']
+
+    def poll(self, timeout=0, wfd=None):
+        """Handle records that are available.
+
+        :param timeout: seconds to wait for data, None to block
+        :param wfd: file descriptor to wait for as well
+        :return: True if wfd is ready for writing
+        """
+        wlist = [] if wfd is None else [wfd]
+        try:
+            ready, writable, unused = select(list(self.streams), wlist, [],
+                                             timeout)
+        except select_error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return False
+        for fd in ready:
+            self._read(fd)
+        return bool(writable)
+
+    def _read(self, fd):
+        stream = self.streams[fd]
+        data = os.read(fd, 65536)
+        if not data:  # EOF
+            del self.streams[fd]
+            lines = [stream[1]] if stream[1] else []
+        else:
+            lines = (stream[1] + data).split('\n')
+            stream[1] = lines.pop()
+        for line in lines:
+            try:
+                record = parse_record(line)
+            except (IndexError, ValueError):
+                record = ('error', None, None, line)
+            if record[0] == 'exit':
+                stream[0].returncode = int(record[3])
+            else:
+                self.callback(stream[0], record)
+
+    def write(self, worker, data):
+        """Send data to given worker, handle records till it's possible.
+
+        Worker that cannot write its results doesn't read its input, so
+        the results are read while its input pipe is full.
+        """
+        fd = worker.stdin.fileno()
+        while not self.poll(None, fd):
+            pass
+        worker.stdin.write(data)
+
+    def close(self, worker):
+        """Close worker's input, handle remaining records and wait for it.
+
+        :return: worker's exit status
+        """
+        worker.stdin.close()
+        fd = worker.stdout.fileno()
+        while fd in self.streams:
+            self.poll(None)
+        return worker.wait()
+
+
+if __name__ == '__main__':
+    sys.exit(compile_files(sys.stdin, sys.stdout))
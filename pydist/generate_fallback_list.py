@@ -20,58 +20,373 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+
+"""Generate dist_fallback file (and its index).
+
+Egg metadata paths are read (line by line) from apt-file's output or from
+given Contents-*.gz files, (distribution name, Debian package) pairs are
+sorted in chunks that are merged at the end, so memory usage doesn't
+depend on archive's size. If more than one package provides the same
+distribution, the lowest package name is used.
+
+Contents files (f.e. one for each architecture and component) are scanned
+in parallel.
+
+Given Contents files used to generate previous dist_fallback (see
+--old-contents), only entries of distributions that changed in new
+Contents files are patched.
+"""
+
+from __future__ import with_statement
+import gzip
+import heapq
+import optparse
 import os
+import re
 import sys
+from itertools import chain, groupby, imap
+from multiprocessing import Pool, cpu_count
 from subprocess import Popen, PIPE
+from tempfile import TemporaryFile
 
-skip_sensible_names = True if '--skip-sensible-names' in sys.argv else False
-os.chdir(os.path.dirname(__file__))
-if os.path.isdir('../debpython'):
-    sys.path.append('..')
+HERE = os.path.dirname(os.path.abspath(__file__))
+if os.path.isdir(os.path.join(HERE, '../debpython')):
+    sys.path.append(os.path.join(HERE, '..'))
 else:
     sys.path.append('/usr/share/python/debpython/')
-from debpython.pydist import sensible_pname
-
-
-if not os.path.isdir('cache'):
-    process = Popen('apt-file -s sources.list -c cache update', shell=True)
-    process.communicate()
-    if process.returncode != 0:
-        sys.stderr.write('Cannot download APT data files')
-        exit(1)
-
-# find .egg-info files/directories
-process = Popen('apt-file -s sources.list -c cache find -x '
-                '"/usr/((share/pyshared)|(lib/python2\.[0-9]/((site)|(dist))-packages)|(share/python-support/[^/]+))/[^/]*\.egg-info"',
-                shell=True, stdout=PIPE)
-stdout, stderr = process.communicate()
-if process.returncode != 0:
-    sys.stderr.write('Cannot find packages with Egg metadata')
-    exit(2)
-
-processed = set()
-result = []
-for line in stdout.splitlines():
-    pname, path = line.split(': ', 1)
-    if pname == 'python-setuptools':
-        continue
-    egg_name = [i.split('-', 1)[0] for i in path.split('/')\
-                if i.endswith('.egg-info')][0]
-    if egg_name.endswith('.egg'):
-        egg_name = egg_name[:-4]
-    if skip_sensible_names and sensible_pname(egg_name) == pname:
-        continue
-    if egg_name not in processed:
-        processed.add(egg_name)
-        result.append("%s %s\n" % (egg_name, pname))
-        #result.append("%s %s\t%s\n" % (egg_name, pname, path))
-
-result.sort()
-fp = open('dist_fallback', 'w')
-fp.write('python python\n')
-fp.write('setuptools python-pkg-resources\n')
-fp.write('wsgiref python (>= 2.5) | python-wsgiref\n')
-fp.write('argparse python (>= 2.7) | python-argparse\n')
-# wasn't recognized due to .pth file (egg-info is in PIL/ and not in *-packages/)
-fp.write('pil python-imaging\n')
-fp.writelines(result)
+from debpython.pydist import (sensible_pname, index_path, read_fallback,
+                               write_index)
+
+EGG_RE = re.compile(r'(?:^|/)usr/(?:share/pyshared|'
+                    r'lib/python2\.[0-9]/(?:site|dist)-packages|'
+                    r'share/python-support/[^/]+)/([^/]*)\.egg-info')
+APT_FILE_PATTERN = (r'/usr/((share/pyshared)|'
+                    r'(lib/python2\.[0-9]/((site)|(dist))-packages)|'
+                    r'(share/python-support/[^/]+))/[^/]*\.egg-info')
+IGNORED_PACKAGES = ('python-setuptools',)
+# entries that cannot be generated from archive's file lists
+STATIC_ENTRIES = (
+    'python python\n',
+    'setuptools python-pkg-resources\n',
+    'wsgiref python (>= 2.5) | python-wsgiref\n',
+    'argparse python (>= 2.7) | python-argparse\n',
+    # wasn't recognized due to .pth file (egg-info is in PIL/ and not in
+    # *-packages/)
+    'pil python-imaging\n')
+STATIC_NAMES = frozenset(i.split(' ', 1)[0] for i in STATIC_ENTRIES)
+CHUNK_SIZE = 100000  # number of entries sorted in memory
+
+
+def egg_name(path):
+    """Return distribution name if given path contains public Egg metadata.
+
+    >>> egg_name('/usr/lib/python2.7/dist-packages/Foo-1.0.egg-info/PKG-INFO')
+    'Foo'
+    >>> egg_name('usr/share/pyshared/bar.egg-info')
+    'bar'
+    >>> egg_name('usr/lib/python2.7/dist-packages/foo/bar.egg-info') is None
+    True
+    """
+    match = EGG_RE.search(path)
+    if match:
+        name = match.group(1).split('-', 1)[0]
+        if name.endswith('.egg'):
+            name = name[:-4]
+        return name
+
+
+def parse_apt_file(lines):
+    """Generate (path, package names) pairs from apt-file's output."""
+    for line in lines:
+        pname, _, path = line.rstrip('\n').partition(': ')
+        if path:
+            yield path, (pname,)
+
+
+def parse_contents(lines):
+    """Generate (path, package names) pairs from Contents file.
+
+    >>> list(parse_contents(['usr/bin/foo   admin/foo,python/python-foo\\n']))
+    [('usr/bin/foo', ['foo', 'python-foo'])]
+    """
+    for line in lines:
+        try:
+            path, locations = line.rstrip('\n').rsplit(None, 1)
+        except ValueError:
+            continue
+        yield path, [i.rsplit('/', 1)[-1] for i in locations.split(',')]
+
+
+def egg_entries(items):
+    """Generate "distname package" lines from (path, packages) pairs."""
+    for path, pnames in items:
+        if '.egg-info' not in path:  # fast path, most lines are skipped
+            continue
+        name = egg_name(path)
+        if name is None:
+            continue
+        for pname in pnames:
+            if pname not in IGNORED_PACKAGES:
+                yield "%s %s\n" % (name, pname)
+
+
+def scan_contents(fpath):
+    """Return sorted "distname package" lines from one Contents file.
+
+    Used by worker processes, see read_entries().
+    """
+    lines = (i for i in contents_lines([fpath]) if '.egg-info' in i)
+    return sorted(set(egg_entries(parse_contents(lines))))
+
+
+def contents_files(paths):
+    """Expand directories to Contents-*.gz files available in them."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fn in sorted(files):
+                if fn.startswith('Contents-') and fn.endswith('.gz'):
+                    yield os.path.join(root, fn)
+
+
+def sort_entries(entries, chunk_size=CHUNK_SIZE):
+    """Sort and dedup entries, spill chunks to temporary files if needed."""
+    chunks = []
+    buffer_ = set()
+    for entry in entries:
+        buffer_.add(entry)
+        if len(buffer_) >= chunk_size:
+            fp = TemporaryFile()
+            fp.writelines(sorted(buffer_))
+            fp.seek(0)
+            chunks.append(fp)
+            buffer_ = set()
+    previous = None
+    for entry in heapq.merge(sorted(buffer_), *chunks):
+        if entry != previous:
+            yield entry
+            previous = entry
+    for fp in chunks:
+        fp.close()
+
+
+def entry_groups(entries):
+    """Generate (distname, "distname package" lines) pairs.
+
+    :param entries: sorted "distname package" lines
+    """
+    for name, items in groupby(entries, lambda i: i.split(' ', 1)[0]):
+        yield name, list(items)
+
+
+def choose_entry(name, entries, skip_sensible_names=False):
+    """Return entry with the lowest package name (or None)."""
+    for entry in entries:
+        pname = entry.rstrip('\n').split(' ', 1)[1]
+        if skip_sensible_names and sensible_pname(name) == pname:
+            continue
+        return entry
+
+
+def fallback_entries(entries, skip_sensible_names=False):
+    """Choose one package for each distribution name.
+
+    :param entries: sorted "distname package" lines
+    """
+    for name, items in entry_groups(entries):
+        entry = choose_entry(name, items, skip_sensible_names)
+        if entry is not None:
+            yield entry
+
+
+def changed_entries(old_entries, new_entries, skip_sensible_names=False):
+    """Generate (distname, new entry or None) for changed distributions.
+
+    >>> list(changed_entries(['a x\\n', 'b y\\n', 'c z\\n'],
+    ...                      ['a x\\n', 'b w\\n', 'b y\\n', 'd z\\n']))
+    [('b', 'b w\\n'), ('c', None), ('d', 'd z\\n')]
+
+    :param old_entries: sorted "distname package" lines (previous run)
+    :param new_entries: sorted "distname package" lines
+    """
+    old = entry_groups(old_entries)
+    new = entry_groups(new_entries)
+    old_name, old_items = next(old, (None, None))
+    new_name, new_items = next(new, (None, None))
+    while old_name is not None or new_name is not None:
+        if new_name is None or (old_name is not None and old_name < new_name):
+            name, items = old_name, None  # removed from the archive
+            old_name, old_items = next(old, (None, None))
+        elif old_name is None or new_name < old_name:
+            name, items = new_name, new_items  # added to the archive
+            new_name, new_items = next(new, (None, None))
+        else:
+            name, items = new_name, new_items
+            unchanged = old_items == new_items
+            old_name, old_items = next(old, (None, None))
+            new_name, new_items = next(new, (None, None))
+            if unchanged:
+                continue
+        if name in STATIC_NAMES:
+            continue
+        if items is None:
+            yield name, None
+        else:
+            yield name, choose_entry(name, items, skip_sensible_names)
+
+
+def patch_fallback(lines, changes):
+    """Apply changes to previous dist_fallback's lines.
+
+    Static entries (at the beginning of the file) and distributions not
+    mentioned in changes are left untouched, new ones are inserted in
+    sorted order.
+
+    :param changes: {distname: new entry or None}
+    """
+    changes = dict(changes)
+    added = sorted(((name, entry) for name, entry in changes.iteritems()
+                    if entry), reverse=True)  # pop() the lowest one
+    for line in lines:
+        name = line.split(' ', 1)[0]
+        if name not in STATIC_NAMES:
+            while added and added[-1][0] < name:
+                name_, entry = added.pop()
+                if changes.pop(name_, None):  # not in previous file
+                    yield entry
+        if name in changes:
+            entry = changes.pop(name)
+            if entry:
+                yield entry
+        else:
+            yield line
+    for name, entry in reversed(added):
+        if changes.get(name):
+            yield entry
+
+
+def apt_file_lines():
+    """Generate apt-file's output (download APT data files if needed)."""
+    if not os.path.isdir(os.path.join(HERE, 'cache')):
+        process = Popen('apt-file -s sources.list -c cache update',
+                        shell=True, cwd=HERE)
+        process.communicate()
+        if process.returncode != 0:
+            sys.stderr.write('Cannot download APT data files\n')
+            exit(1)
+
+    # find .egg-info files/directories
+    process = Popen(['apt-file', '-s', 'sources.list', '-c', 'cache',
+                     'find', '-x', APT_FILE_PATTERN], stdout=PIPE, cwd=HERE)
+    for line in process.stdout:
+        yield line
+    process.stdout.close()
+    if process.wait() != 0:
+        sys.stderr.write('Cannot find packages with Egg metadata\n')
+        exit(2)
+
+
+def contents_lines(fpaths):
+    """Generate lines of given (optionally gzipped) Contents files."""
+    for fpath in fpaths:
+        if fpath.endswith('.gz'):
+            fp = gzip.open(fpath, 'rb')
+        else:
+            fp = open(fpath, 'rb')
+        try:
+            for line in fp:
+                yield line
+        finally:
+            fp.close()
+
+
+def read_entries(paths, chunk_size=CHUNK_SIZE, jobs=1):
+    """Return sorted "distname package" lines from given Contents files.
+
+    apt-file is used if no file is given.
+
+    :param paths: Contents files or directories with Contents-*.gz files
+    :param jobs: number of processes scanning Contents files
+    """
+    if not paths:
+        items = parse_apt_file(apt_file_lines())
+        return sort_entries(egg_entries(items), chunk_size)
+
+    fpaths = list(contents_files(paths))
+    if jobs > 1 and len(fpaths) > 1:
+        pool = Pool(min(jobs, len(fpaths)))
+        # imap keeps files' order, result doesn't depend on workers' speed
+        results = pool.imap(scan_contents, fpaths)
+        pool.close()
+    else:
+        results = imap(scan_contents, fpaths)
+    return sort_entries(chain.from_iterable(results), chunk_size)
+
+
+def write_fallback(lines, fpath):
+    """Write dist_fallback file."""
+    tmp_fpath = "%s.%s" % (fpath, os.getpid())
+    with open(tmp_fpath, 'w') as fp:
+        fp.writelines(lines)
+    os.rename(tmp_fpath, fpath)
+
+
+def main(argv):
+    usage = '%prog [--contents PATH]... [--skip-sensible-names]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('--skip-sensible-names', action='store_true',
+        default=False, help='skip distributions that are provided by '
+        'packages with names guessed by sensible_pname()')
+    parser.add_option('--contents', action='append', default=[],
+        metavar='PATH', help='read local Contents file (or all '
+        'Contents-*.gz files in given directory) instead of using apt-file '
+        '(can be used multiple times)')
+    parser.add_option('-j', '--jobs', type='int', default=0,
+        help='number of processes scanning Contents files (0 means one '
+        'per CPU)')
+    parser.add_option('--old-contents', action='append', default=[],
+        metavar='PATH', help='Contents file used to generate previous '
+        'output, patch only distributions that changed since then (can be '
+        'used multiple times)')
+    parser.add_option('--previous', metavar='FILE',
+        help='previous dist_fallback file [default: output file]')
+    parser.add_option('-o', '--output',
+        default=os.path.join(HERE, 'dist_fallback'),
+        metavar='FILE', help='[default: %default]')
+    parser.add_option('--chunk-size', type='int', default=CHUNK_SIZE,
+        metavar='N', help='sort at most N entries in memory '
+        '[default: %default]')
+    parser.add_option('--index-only', action='store_true', default=False,
+        help='(re)compile index of existing output file')
+    (options, args) = parser.parse_args(argv)
+    if options.jobs < 0:
+        parser.error('number of jobs cannot be negative')
+    elif options.jobs == 0:
+        options.jobs = cpu_count()
+
+    if options.old_contents:
+        if not options.contents:
+            parser.error('--old-contents requires --contents')
+        changes = changed_entries(
+            read_entries(options.old_contents, options.chunk_size,
+                         options.jobs),
+            read_entries(options.contents, options.chunk_size, options.jobs),
+            options.skip_sensible_names)
+        with open(options.previous or options.output) as fp:
+            lines = list(patch_fallback(fp, changes))
+        write_fallback(lines, options.output)
+    elif not options.index_only:
+        entries = read_entries(options.contents, options.chunk_size,
+                               options.jobs)
+        write_fallback(chain(STATIC_ENTRIES,
+                             fallback_entries(entries,
+                                              options.skip_sensible_names)),
+                       options.output)
+    write_index(read_fallback(options.output), index_path(options.output))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])